@@ -1,16 +1,29 @@
 from time_tracking.forms import ClockForm
+from time_tracking import export, views
+from time_tracking.instrumentation import instrumented
 from time_tracking.templatetags import clockformats
 from expenses.templatetags import moneyformats
 from time_tracking.middleware import CurrentUserMiddleware
-from time_tracking.models import Clock, Project, Activity, ClockOptions, ActivityOptions, TimeTrackingGroup
+from time_tracking.models import Clock, Project, Activity, ClockOptions, ActivityOptions, TimeTrackingGroup, Holiday
+from time_tracking.settings import CHANGELIST_COUNT_LIMIT, LIVE_STATUS_STREAM, LIVE_STATUS_POLL_INTERVAL
 from django import forms
 from django.conf import settings
 from django.contrib import admin
-from django.http import HttpResponse
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _, ugettext
 from django.http import HttpResponseRedirect
 from django.contrib import messages
+from django.contrib.auth.models import User
+from django.template.response import TemplateResponse
 from django.core.exceptions import PermissionDenied
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+from django.core.servers.basehttp import FileWrapper
+import tempfile
 
 
 class ActivityAdmin(admin.ModelAdmin):
@@ -21,6 +34,11 @@ class ClockOptionsAdmin(admin.ModelAdmin):
     list_display = ('username', 'display_balance', 'display_closing', 'hours_per_week', 'unpaid_break', 'weekday_1', 'weekday_2', 'weekday_3', 'weekday_4', 'weekday_5', 'weekday_6', 'weekday_7')
 
 
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ('date', 'name')
+    date_hierarchy = 'date'
+
+
 class ActivityOptionsAdmin(admin.ModelAdmin):
     list_display = ('activity', 'username', 'rate_formatted')
 
@@ -39,6 +57,123 @@ class ClockInForm(forms.Form):
             queryset=Project.get_queryset_for_current_user(), required=False)
 
 
+class TeamSummaryForm(forms.Form):
+    group = forms.ModelChoiceField(label=_('Group'), queryset=TimeTrackingGroup.objects.all(), required=False)
+    start = forms.DateField(label=_('from'))
+    end = forms.DateField(label=_('to'))
+
+
+def count_limited(queryset, limit=CHANGELIST_COUNT_LIMIT):
+    """
+    Returns the number of objects of `queryset`, but counts `limit` objects
+    at most, and whether there are more than those.
+    """
+    count = queryset.order_by().values('pk')[:limit + 1].count()
+    return min(count, limit), count > limit
+
+
+class ClockChangeList(ChangeList):
+    """
+    Change list of clock entries, which are counted up to
+    `CHANGELIST_COUNT_LIMIT`. When ordered by start (the default), pages are
+    looked up by seeking to the entries before or after the ones of the
+    previous page instead of skipping all entries of the previous pages.
+    """
+    AFTER_VAR = 'after'
+    BEFORE_VAR = 'before'
+    KEYSET_ORDERING = ['-start', '-pk']
+
+    def __init__(self, request, *args, **kwargs):
+        self.seek = None
+        for var in (self.AFTER_VAR, self.BEFORE_VAR):
+            if var in request.GET:
+                try:
+                    self.seek = (var, int(request.GET[var]))
+                except ValueError:
+                    raise IncorrectLookupParameters
+        super(ClockChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_query_set(self, request):
+        # the entries to seek to are no lookups, and links to other filters
+        # or orderings start at the first page
+        for var in (self.AFTER_VAR, self.BEFORE_VAR):
+            self.params.pop(var, None)
+        return super(ClockChangeList, self).get_query_set(request)
+
+    def get_results(self, request):
+        ordering = []
+        for field in self.query_set.query.order_by:
+            if field not in ordering:
+                ordering.append(field)
+        self.keyset_pagination = not self.show_all and not self.page_num and \
+            ordering == self.KEYSET_ORDERING
+        self.result_count, self.result_count_limited = count_limited(self.query_set)
+        if not self.query_set.query.where:
+            self.full_result_count = self.result_count
+        else:
+            self.full_result_count = count_limited(self.root_query_set)[0]
+        self.can_show_all = not self.result_count_limited and \
+            self.result_count <= self.list_max_show_all
+        # all columns of the rows are displayed without further queries
+        queryset = self.query_set.select_related('activity', 'project', 'user')
+        self.paginator = self.model_admin.get_paginator(request, queryset, self.list_per_page)
+        # pages beyond the counted entries can only be reached by seeking
+        self.paginator._count = self.result_count
+        self.previous_url = self.next_url = None
+
+        if self.keyset_pagination:
+            result_list = self.get_keyset_results(request, queryset)
+            self.multi_page = bool(self.previous_url or self.next_url)
+        else:
+            self.multi_page = self.result_count > self.list_per_page
+            if (self.show_all and self.can_show_all) or not self.multi_page:
+                result_list = queryset
+            else:
+                try:
+                    result_list = self.paginator.page(self.page_num + 1).object_list
+                except InvalidPage:
+                    raise IncorrectLookupParameters
+        self.result_list = Clock.resolve_rates(result_list)
+
+    def get_keyset_results(self, request, queryset):
+        """
+        Returns the entries of the page starting after or ending before the
+        entry given by the request, or of the first page, and sets the URLs of
+        the pages before and after them.
+        """
+        per_page = self.list_per_page
+        start = None
+        if self.seek:
+            var, pk = self.seek
+            starts = self.root_query_set.filter(pk=pk).values_list('start', flat=True)[:1]
+            if starts:
+                start = starts[0]
+
+        if start is None:
+            # first page, or the entry to seek to has been deleted
+            result_list = list(queryset[:per_page + 1])
+            has_previous, has_next = False, len(result_list) > per_page
+            result_list = result_list[:per_page]
+        elif var == self.AFTER_VAR:
+            result_list = list(queryset.filter(Q(start__lt=start) | Q(start=start, pk__lt=pk))[:per_page + 1])
+            has_previous, has_next = True, len(result_list) > per_page
+            result_list = result_list[:per_page]
+        else:
+            result_list = list(queryset.filter(Q(start__gt=start) | Q(start=start, pk__gt=pk)).reverse()[:per_page + 1])
+            has_previous, has_next = len(result_list) > per_page, True
+            result_list = result_list[:per_page]
+            result_list.reverse()
+
+        if result_list:
+            if has_previous:
+                self.previous_url = self.get_query_string({self.BEFORE_VAR: result_list[0].pk})
+            if has_next:
+                self.next_url = self.get_query_string({self.AFTER_VAR: result_list[-1].pk})
+        elif has_previous:
+            self.previous_url = self.get_query_string()
+        return result_list
+
+
 class ClockAdmin(admin.ModelAdmin):
     date_hierarchy = 'start'
     list_display = ('status_icon', 'weekday', 'start_date', 'start_time', 'end_time', 'hours_rounded', 'hours_credited_rounded', 'activity', 'rate_formatted', 'cost_formatted', 'project', 'comment')
@@ -46,8 +181,19 @@ class ClockAdmin(admin.ModelAdmin):
     form = ClockForm
     ordering = ['-start']
 
+    # change_list parameters that can be applied to the daily totals as well.
+    # The lookups of the date hierarchy (start__year etc.) compare UTC dates,
+    # whereas daily totals are kept per local date, so they can't be.
+    ROLLUP_LOOKUPS = {
+        'start__gte': 'date__gte',
+        'start__lt': 'date__lt',
+        'activity__id__exact': 'activity__id__exact',
+        'user__id__exact': 'user__id__exact',
+    }
+
+    actions = ['export_csv', 'export_xlsx']
     if 'billing' in settings.INSTALLED_APPS:
-        actions = ['bill_selected']
+        actions += ['bill_selected']
 
     def queryset(self, request):
         """
@@ -61,20 +207,46 @@ class ClockAdmin(admin.ModelAdmin):
         
     def bill_selected(self, request, queryset):
         from billing.models import ClockBill
-        bill = ClockBill() 
-        bill.save()
-        if queryset.filter(bill=None).count() != queryset.count():
+        bill = ClockBill()
+        totals = Clock.bill_entries(queryset, bill)
+        if totals['skipped']:
             self.message_user(request, _('Some entries were already billed and were not added to this bill.'))
-        for obj in queryset.filter(bill=None):
-            obj.bill = bill
-            if not obj.billed_rate:
-                obj.billed_rate = obj.get_rate() or 0
-            if not obj.billed_time_factor:
-                obj.billed_time_factor = obj.activity.time_factor
-            obj.save()
+        if not totals['entries']:
+            return
+        self.message_user(request, _('Billed %(entries)i entries: %(hours)s, %(cost)s.') % {
+            'entries': totals['entries'], 
+            'hours': clockformats.hours(totals['hours']), 
+            'cost': moneyformats.money(totals['cost']),
+        })
         return HttpResponseRedirect(bill.get_admin_url())
     bill_selected.short_description = _('Create bill with selected %(verbose_name_plural)s')
 
+    def response_action(self, request, queryset):
+        response = super(ClockAdmin, self).response_action(request, queryset)
+        # actions can only return instances of HttpResponse, which StreamingHttpResponse is not
+        return getattr(request, 'streaming_response', response)
+
+    def export_csv(self, request, queryset):
+        response = StreamingHttpResponse(export.iter_csv(queryset), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="clock.csv"'
+        request.streaming_response = response
+    export_csv.short_description = _('Export selected %(verbose_name_plural)s as CSV')
+
+    def export_xlsx(self, request, queryset):
+        try:
+            import xlsxwriter
+        except ImportError:
+            self.message_user(request, _('Please install XlsxWriter in order to export Excel files.'))
+            return
+        output = tempfile.TemporaryFile()
+        export.write_xlsx(queryset, output)
+        output.seek(0)
+        response = StreamingHttpResponse(FileWrapper(output), 
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response['Content-Disposition'] = 'attachment; filename="clock.xlsx"'
+        request.streaming_response = response
+    export_xlsx.short_description = _('Export selected %(verbose_name_plural)s as Excel file')
+
     def add_view(self, request, form_url='', extra_context=None):
         if not request.user.has_perm('time_tracking.can_set_user'):
             self.exclude = ('user',)
@@ -90,6 +262,7 @@ class ClockAdmin(admin.ModelAdmin):
             
         return super(ClockAdmin, self).change_view(request, object_id, form_url, extra_context)
 
+    @instrumented('clock_change_list', render=True)
     def changelist_view(self, request, extra_context=None):
         if not request.user.has_perm('time_tracking.can_set_user'):
             if 'user' in self.list_display:
@@ -102,10 +275,21 @@ class ClockAdmin(admin.ModelAdmin):
                 self.list_display += ('user',)
             self.list_filter = ['start', 'project', 'activity', 'user']
 
-        from django.contrib.admin.views.main import ChangeList
-        cl = ChangeList(request, self.model, self.list_display, self.list_display_links,
-            self.list_filter, self.date_hierarchy, self.search_fields,
-            self.list_select_related, self.list_per_page, self.list_max_show_all, self.list_editable, self)
+        # the change list is created with the same arguments as by the
+        # superclass, which reuses it (see get_changelist())
+        list_display = self.get_list_display(request)
+        list_display_links = self.get_list_display_links(request, list_display)
+        if self.get_actions(request):
+            list_display = ['action_checkbox'] + list(list_display)
+        try:
+            cl = self.get_changelist(request)(request, self.model, list_display, list_display_links,
+                self.get_list_filter(request), self.date_hierarchy, self.search_fields,
+                self.list_select_related, self.list_per_page, self.list_max_show_all, self.list_editable, self)
+        except IncorrectLookupParameters:
+            # the superclass redirects
+            return super(ClockAdmin, self).changelist_view(request, extra_context)
+        request.clock_changelist = cl
+
         clocked_in_time = Clock.clocked_in_time(request.user)
         if clocked_in_time and clocked_in_time.project:
             # TODO this is not working
@@ -113,18 +297,57 @@ class ClockAdmin(admin.ModelAdmin):
         else:
             initial = {'project': Project.get_latest_for_current_user()}
         extra_context = {
-            'time_info': Clock.summarize(request.user, cl.query_set),
+            'time_info': Clock.summarize(request.user, cl.query_set, self.get_rollup_filter(request, cl)),
+            # identifies the cached summary to update live
+            'live_summary_signature': Clock.get_filter_signature(cl.query_set),
+            'live_status_stream': LIVE_STATUS_STREAM,
+            'live_status_poll_interval': LIVE_STATUS_POLL_INTERVAL,
             'clock_in_form': ClockInForm(initial=initial),
         }
         
         return super(ClockAdmin, self).changelist_view(request, extra_context)
 
+    def get_changelist(self, request, **kwargs):
+        """
+        Returns the change list class, or a callable returning the change list
+        changelist_view() created for summarizing the entries, so that they
+        are only filtered and counted once.
+        """
+        cl = getattr(request, 'clock_changelist', None)
+        if cl is not None:
+            return lambda *args: cl
+        return ClockChangeList
+
+    def get_rollup_filter(self, request, cl):
+        """
+        Returns ClockDay lookups equivalent to the filters of the change_list,
+        or None if any of them can't be applied to the daily totals.
+        """
+        from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, SEARCH_VAR, IS_POPUP_VAR, TO_FIELD_VAR
+        if cl.query:
+            return None
+        rollup_filter = {}
+        if not request.user.has_perm('time_tracking.can_set_user'):
+            rollup_filter['user'] = request.user
+        for key, value in cl.params.items():
+            if key in (ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, SEARCH_VAR, IS_POPUP_VAR, TO_FIELD_VAR):
+                continue
+            if key not in self.ROLLUP_LOOKUPS:
+                return None
+            if key in ('start__gte', 'start__lt') and not parse_date(value):
+                return None
+            rollup_filter[self.ROLLUP_LOOKUPS[key]] = value
+        return rollup_filter
+
     def get_urls(self):
         from django.conf.urls.defaults import patterns, url
         urls = super(ClockAdmin, self).get_urls()
         url_patterns = patterns('',
             url(r'^in/$', self.admin_site.admin_view(self.clock_in), name="time_tracking_clock_in"),
             url(r'^out/$', self.admin_site.admin_view(self.clock_out), name="time_tracking_clock_out"),
+            url(r'^clocked_in/$', self.admin_site.admin_view(self.clocked_in_view), name="time_tracking_clock_clocked_in"),
+            url(r'^team/$', self.admin_site.admin_view(self.team_summary_view), name="time_tracking_clock_team"),
+            url(r'^live/$', self.admin_site.admin_view(views.clock_live), name="time_tracking_clock_live"),
         )
         url_patterns.extend(urls)
         return url_patterns
@@ -133,7 +356,6 @@ class ClockAdmin(admin.ModelAdmin):
         if not self.has_add_permission(request):
             raise PermissionDenied
         else:
-            clocked_in_time = Clock.clocked_in_time(request.user)
             project = None
             if request.method == 'POST':
                 form = ClockInForm(request.POST)
@@ -143,27 +365,22 @@ class ClockAdmin(admin.ModelAdmin):
                     project = form.cleaned_data['project']
                 else:
                     raise forms.ValidationError('Invalid project')
-                
-            can_clock_in = not clocked_in_time
-            if clocked_in_time:
-                if not project or clocked_in_time.project == project:
-                    messages.add_message(request, messages.WARNING, _("Please clock out first. Clocked in: %s") % clocked_in_time.__unicode__())
-                else:
-                    clocked_in_time.clock_out()
-                    messages.add_message(request, messages.SUCCESS, _("Clocked out: %s") % clocked_in_time.__unicode__())
-                    can_clock_in = True
-                
-            if can_clock_in:
-                try:
-                    clock_in_time = Clock.clock_in(request.user, project)
-                    if project:
-                        messages.add_message(request, messages.SUCCESS, _("Clocked into %(project)s: %(clock)s") % 
+
+            try:
+                # switches to the project if clocked into another one
+                clock_in_time, clocked_out_time = Clock.clock_in(request.user, project, switch=bool(project))
+                if clocked_out_time:
+                    messages.add_message(request, messages.SUCCESS, _("Clocked out: %s") % clocked_out_time.__unicode__())
+                if not clock_in_time:
+                    messages.add_message(request, messages.WARNING, _("Please clock out first. Clocked in: %s") % Clock.clocked_in_time(request.user).__unicode__())
+                elif project:
+                    messages.add_message(request, messages.SUCCESS, _("Clocked into %(project)s: %(clock)s") % 
                         {'clock': clock_in_time.__unicode__(), 'project': project.__unicode__()})
-                    else:
-                        messages.add_message(request, messages.SUCCESS, _("Clocked in: %(clock)s") % 
-                            {'clock': clock_in_time.__unicode__()})
-                except ValueError:
-                    messages.add_message(request, messages.WARNING, _("In order to be able to clock in, you'll have to create a first entry."))
+                else:
+                    messages.add_message(request, messages.SUCCESS, _("Clocked in: %(clock)s") % 
+                        {'clock': clock_in_time.__unicode__()})
+            except ValueError:
+                messages.add_message(request, messages.WARNING, _("In order to be able to clock in, you'll have to create a first entry."))
 
             return HttpResponseRedirect('../')
 
@@ -171,15 +388,67 @@ class ClockAdmin(admin.ModelAdmin):
         if not self.has_change_permission(request):
             raise PermissionDenied
         else:
-            clocked_in_time = Clock.clocked_in_time(request.user)
-            if (clocked_in_time != None):
-                clocked_in_time.clock_out()
-                messages.add_message(request, messages.SUCCESS, _("Clocked out: %s") % clocked_in_time.__unicode__())
+            clocked_out_time = Clock.clock_out_user(request.user)
+            if clocked_out_time:
+                messages.add_message(request, messages.SUCCESS, _("Clocked out: %s") % clocked_out_time.__unicode__())
             else:
                 messages.add_message(request, messages.WARNING, _("Please clock in first."))
 
             return HttpResponseRedirect('../')
 
+    def clocked_in_view(self, request):
+        """
+        Lists the team members who are currently clocked in, i.e. all active
+        users if the user may set the user of entries, or else the users 
+        sharing a group with the user.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        users = User.objects.filter(is_active=True)
+        if not request.user.has_perm('time_tracking.can_set_user'):
+            users = users.filter(groups__in=request.user.groups.all()).distinct()
+        users = list(users.order_by('username'))
+        times = Clock.get_clocked_in_times(users)
+        clocked_in = [(user, times[user.pk]) for user in users if user.pk in times]
+        context = {
+            'title': _('Clocked in now'),
+            'clocked_in': clocked_in,
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+        }
+        return TemplateResponse(request, 'admin/time_tracking/clock/clocked_in.html', 
+            context, current_app=self.admin_site.name)
+
+    def team_summary_view(self, request):
+        """
+        Displays the summaries of all active users, or of the members of a 
+        group, for a range of dates (the current month by default).
+        """
+        if not request.user.has_perm('time_tracking.can_set_user'):
+            raise PermissionDenied
+        today = Clock.local_date(timezone.now())
+        form = TeamSummaryForm(request.GET or None, initial={
+            'start': today.replace(day=1),
+            'end': today,
+        })
+        if form.is_bound and form.is_valid():
+            group, start, end = form.cleaned_data['group'], form.cleaned_data['start'], form.cleaned_data['end']
+        else:
+            group, start, end = None, today.replace(day=1), today
+        users = User.objects.filter(is_active=True).order_by('username')
+        if group:
+            users = users.filter(groups=group)
+        summaries = Clock.summarize_team(users, start, end)
+        context = {
+            'title': _('Team summary'),
+            'form': form,
+            'summaries': summaries,
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+        }
+        return TemplateResponse(request, 'admin/time_tracking/clock/team.html', 
+            context, current_app=self.admin_site.name)
+
     def cost_formatted(self, obj):
         return moneyformats.money(obj.get_cost())
     cost_formatted.short_description = _('cost')
@@ -192,6 +461,18 @@ class ClockAdmin(admin.ModelAdmin):
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ('name', 'group_names', 'status', 'budget_formatted', 'hours_sum_formatted', 'cost_sum_formatted', 'balance_formatted', 'coverage_formatted')
 
+    def queryset(self, request):
+        """
+        Annotates the sums displayed in the change_list so that no additional
+        queries are needed per project.
+        """
+        qs = super(ProjectAdmin, self).queryset(request)
+        return Project.annotate_totals(qs).prefetch_related('groups')
+
+    @instrumented('project_change_list', render=True)
+    def changelist_view(self, request, extra_context=None):
+        return super(ProjectAdmin, self).changelist_view(request, extra_context)
+
     def group_names(self, obj):
         return ', '.join([group.__unicode__() for group in obj.groups.all()])
     group_names.short_description = _('groups')
@@ -204,18 +485,22 @@ class ProjectAdmin(admin.ModelAdmin):
     def hours_sum_formatted(self, obj):
         return clockformats.hours(obj.sum_hours(), units=False)
     hours_sum_formatted.short_description = _('hours spent')
+    hours_sum_formatted.admin_order_field = 'hours_sum'
     
     def cost_sum_formatted(self, obj):
         return moneyformats.money(obj.sum_cost())
     cost_sum_formatted.short_description = _('budget spent')
+    cost_sum_formatted.admin_order_field = 'cost_sum'
 
     def balance_formatted(self, obj):
         return moneyformats.money(obj.balance())
     balance_formatted.short_description = _('balance')
+    balance_formatted.admin_order_field = 'budget_balance'
     
     def coverage_formatted(self, obj):
         return moneyformats.percent(obj.coverage())
     coverage_formatted.short_description = _('coverage')
+    coverage_formatted.admin_order_field = 'budget_coverage'
 
 
 class TimeTrackingGroupAdmin(admin.ModelAdmin):
@@ -236,4 +521,5 @@ admin.site.register(Project, ProjectAdmin)
 admin.site.register(ClockOptions, ClockOptionsAdmin)
 admin.site.register(ActivityOptions, ActivityOptionsAdmin)
 admin.site.register(Activity, ActivityAdmin)
+admin.site.register(Holiday, HolidayAdmin)
 admin.site.register(TimeTrackingGroup, TimeTrackingGroupAdmin)
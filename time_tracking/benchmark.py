@@ -0,0 +1,271 @@
+# coding=utf-8
+"""
+Benchmarks of the hot paths of time_tracking, using generated data. All data
+is created with the prefix BENCHMARK_PREFIX and can be removed using clear().
+"""
+from time_tracking.models import Clock, ClockDay, ClockBalance, Project, ProjectBudgetSnapshot, Activity, ActivityOptions, TimeTrackingGroup
+from time_tracking.middleware import acting_as, with_current_user
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models import Count
+from django.test.client import Client
+from django.utils import timezone
+from multiprocessing.pool import ThreadPool
+import datetime
+import random
+import threading
+import time
+
+BENCHMARK_PREFIX = 'benchmark-'
+BATCH_SIZE = 1000
+ADMIN_PASSWORD = 'benchmark'
+# entries per page of the larger clock change list, whose number of queries
+# should equal that of the default one
+LARGE_PAGE_SIZE = 500
+
+# name, type, time factor
+ACTIVITIES = (
+    ('work', Activity.WORK, 1),
+    ('overtime', Activity.WORK, 1.5),
+    ('travel', Activity.WORK, 0.5),
+    ('holidays', Activity.PAID_LEAVE, 1),
+    ('compensatory time', Activity.PAID_LEAVE, -1),
+    ('unpaid leave', Activity.UNPAID_LEAVE, 0),
+)
+
+
+def clear(using=DEFAULT_DB_ALIAS):
+    """
+    Deletes all generated data.
+    """
+    users = User.objects.using(using).filter(username__startswith=BENCHMARK_PREFIX)
+    user_ids = list(users.values_list('pk', flat=True))
+    if user_ids:
+        # deleting the entries one by one would update daily totals, running
+        # totals and budget snapshots for each of them
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        connection.cursor().execute('DELETE FROM %s WHERE %s IN (%s)' % (qn(Clock._meta.db_table), 
+            qn(Clock._meta.get_field('user').column), ', '.join(['%s'] * len(user_ids))), user_ids)
+        transaction.commit_unless_managed(using=using)
+        for user_id in user_ids:
+            Clock.forget_clocked_in_time(user_id)
+        Clock.forget_all_summaries()
+    ClockDay.objects.using(using).filter(user__in=user_ids).delete()
+    ClockBalance.objects.using(using).filter(user__in=user_ids).delete()
+    ActivityOptions.objects.using(using).filter(activity__name__startswith=BENCHMARK_PREFIX).delete()
+    Project._base_manager.using(using).filter(name__startswith=BENCHMARK_PREFIX).delete()
+    Activity.objects.using(using).filter(name__startswith=BENCHMARK_PREFIX).delete()
+    TimeTrackingGroup.objects.using(using).filter(name__startswith=BENCHMARK_PREFIX).delete()
+    users.delete()
+
+
+def seed(entries, users=10, groups=2, projects=20, seed=0, using=DEFAULT_DB_ALIAS):
+    """
+    Creates users, groups, projects, activities with different time factors,
+    rates per activity and some of the users, and `entries` clock entries 
+    distributed over the users, going back from today. The first user is a 
+    superuser that can log in with ADMIN_PASSWORD. Returns the users.
+    """
+    rand = random.Random(seed)
+    group_objects = [TimeTrackingGroup.objects.using(using).create(name='%sgroup-%i' % (BENCHMARK_PREFIX, i))
+        for i in range(groups)]
+    user_objects = []
+    for i in range(users):
+        user = User(username='%suser-%i' % (BENCHMARK_PREFIX, i), is_staff=True, is_superuser=(i == 0))
+        user.set_password(ADMIN_PASSWORD)
+        user.save(using=using)
+        user.groups.add(group_objects[i % groups])
+        user_objects.append(user)
+    project_objects = []
+    for i in range(projects):
+        project = Project(name='%sproject-%i' % (BENCHMARK_PREFIX, i), budget=rand.choice([None, 10000, 100000]))
+        project.save(using=using)
+        project.groups.add(group_objects[i % groups])
+        project_objects.append(project)
+    activity_objects = []
+    for name, activity_type, time_factor in ACTIVITIES:
+        activity = Activity.objects.using(using).create(name=BENCHMARK_PREFIX + name, 
+            activity_type=activity_type, time_factor=time_factor)
+        activity_objects.append(activity)
+        ActivityOptions.objects.using(using).create(activity=activity, rate=100)
+        for user in rand.sample(user_objects, len(user_objects) / 3):
+            ActivityOptions.objects.using(using).create(activity=activity, user=user, rate=rand.randint(50, 150))
+
+    # entries of each user on consecutive working days, going back from today
+    per_user = max(1, entries / len(user_objects))
+    batch = []
+    today = Clock.start_of_day(timezone.now())
+    for user in user_objects:
+        day = today
+        created = 0
+        while created < per_user:
+            day -= datetime.timedelta(days=1)
+            if Clock.django_week_day(day) not in (2, 3, 4, 5, 6):
+                continue
+            start = day + datetime.timedelta(hours=rand.randint(6, 9))
+            for j in range(min(rand.randint(1, 4), per_user - created)):
+                hours = rand.randint(2, 12) / 4.0
+                end = start + datetime.timedelta(hours=hours)
+                batch.append(Clock(user=user, start=start, end=end, hours=hours, 
+                    activity=activity_objects[0] if rand.random() < .8 else rand.choice(activity_objects),
+                    project=rand.choice(project_objects) if rand.random() < .9 else None))
+                start = end + datetime.timedelta(minutes=rand.randint(0, 60))
+                created += 1
+            if len(batch) >= BATCH_SIZE:
+                Clock.objects.using(using).bulk_create(batch)
+                batch = []
+    Clock.objects.using(using).bulk_create(batch)
+    ClockDay.rebuild(user_objects)
+    ProjectBudgetSnapshot.refresh(project_objects)
+    return user_objects
+
+
+def measure(function, repeat=1, using=DEFAULT_DB_ALIAS, setup=None):
+    """
+    Calls the function and returns the best wall time in seconds and the 
+    number of queries of that call. `setup` is called before each call 
+    without being measured.
+    """
+    connection = connections[using]
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        results = []
+        for i in range(repeat):
+            if setup:
+                setup()
+            connection.queries = []
+            started = time.time()
+            function()
+            results.append((time.time() - started, len(connection.queries)))
+        return min(results)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        connection.queries = []
+
+
+def get_hot_paths(user):
+    """
+    Returns names, functions and setup functions (or None) of the hot paths
+    to measure, for the given user.
+    """
+    entries = Clock.objects.filter(user=user)
+    client = Client()
+    client.login(username=user.username, password=ADMIN_PASSWORD)
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+
+    def post(url, status_code=200):
+        response = client.post(url)
+        assert response.status_code == status_code, response.status_code
+
+    def get_large_page(url):
+        model_admin = site._registry[Clock]
+        list_per_page = model_admin.list_per_page
+        model_admin.list_per_page = LARGE_PAGE_SIZE
+        try:
+            get(url)
+        finally:
+            model_admin.list_per_page = list_per_page
+
+    return (
+        ('summarize', lambda: Clock._summarize(user, entries), None),
+        ('summarize_rollup', lambda: Clock._summarize(user, entries, {'user': user}), None),
+        ('summarize_cached', lambda: Clock.summarize(user, entries), None),
+        ('sum_cost', lambda: Clock.sum_cost(Clock.objects.all()), None),
+        ('sum_hours', lambda: Clock.sum_hours(Clock.objects.all()), None),
+        ('clock_change_list', lambda: get(reverse('admin:time_tracking_clock_changelist')), None),
+        ('clock_change_list_large_page', lambda: get_large_page(reverse('admin:time_tracking_clock_changelist')), None),
+        ('project_change_list', lambda: get(reverse('admin:time_tracking_project_changelist')), None),
+        # a request clocking the user in, who is clocked out before each one
+        ('clock_in', lambda: post(reverse('time_tracking_api_clock_in'), 201), lambda: Clock.clock_out_user(user)),
+    )
+
+
+def run(sizes, users=10, projects=20, repeat=3, keep=False, using=DEFAULT_DB_ALIAS, log=None):
+    """
+    Seeds each of the given numbers of clock entries and measures all hot paths.
+    Returns a list of results that can be serialized as JSON. 
+    """
+    results = []
+    for size in sizes:
+        clear(using)
+        if log:
+            log('Seeding %i entries' % size)
+        user_objects = seed(size, users=users, projects=projects, using=using)
+        # hot paths run on behalf of the superuser, as they would in a request
+        user = user_objects[0]
+        for name, function, setup in get_hot_paths(user):
+            # each call gets a cache of its own, like a request would
+            with acting_as(user):
+                seconds, queries = measure(with_current_user(function), repeat, using, setup)
+            result = {
+                'path': name,
+                'entries': size,
+                'users': users,
+                'seconds': seconds,
+                'queries': queries,
+                'database': connections[using].vendor,
+            }
+            if log:
+                log('%(path)s: %(seconds).3fs, %(queries)i queries' % result)
+            results.append(result)
+    if not keep:
+        clear(using)
+    return results
+
+
+def stress_clock_in(users=2, threads=8, iterations=50, seed_value=0, log=None):
+    """
+    Clocks generated users in, out and into other projects from a pool of 
+    concurrent threads, `iterations` times per thread, on the default database.
+    Returns a dictionary with the numbers of operations and errors, and the pks
+    of users that ended up clocked in with more than one entry, which must be 
+    empty.
+    """
+    clear()
+    user_objects = seed(users, users=users, projects=4, seed=seed_value)
+    project_objects = list(Project._base_manager.filter(name__startswith=BENCHMARK_PREFIX))
+    lock = threading.Lock()
+    result = {'operations': 0, 'errors': 0}
+
+    def work(index):
+        rand = random.Random(seed_value + index)
+        try:
+            for i in range(iterations):
+                user = rand.choice(user_objects)
+                action = rand.choice(('in', 'switch', 'out'))
+                try:
+                    with acting_as(user):
+                        if action == 'out':
+                            Clock.clock_out_user(user)
+                        else:
+                            Clock.clock_in(user, rand.choice(project_objects + [None]), switch=(action == 'switch'))
+                    key = 'operations'
+                except DatabaseError, e:
+                    # e.g. "database is locked" on SQLite, or retries exhausted
+                    if log:
+                        log('%s: %s' % (e.__class__.__name__, e))
+                    key = 'errors'
+                with lock:
+                    result[key] += 1
+        finally:
+            connections[DEFAULT_DB_ALIAS].close()
+
+    pool = ThreadPool(threads)
+    try:
+        pool.map(work, range(threads))
+    finally:
+        pool.close()
+        pool.join()
+
+    result['duplicates'] = list(Clock.objects.filter(user__in=user_objects, end__isnull=True
+        ).values('user').annotate(count=Count('pk')).filter(count__gt=1).values_list('user', flat=True))
+    result['database'] = connections[DEFAULT_DB_ALIAS].vendor
+    clear()
+    return result
@@ -0,0 +1,97 @@
+from time_tracking.settings import SUMMARY_CACHE_SIZE
+from django.conf import settings
+from django.core.cache import get_cache as get_cache_backend
+from django.core.cache.backends.locmem import LocMemCache
+from collections import OrderedDict
+import threading
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the cache configured by the TIME_TRACKING_CACHE setting (an alias 
+    of the CACHES setting), or the default cache, which is a local-memory 
+    cache unless configured otherwise.
+    """
+    global _cache
+    if _cache is None:
+        _cache = get_cache_backend(getattr(settings, 'TIME_TRACKING_CACHE', 'default'))
+    return _cache
+
+
+def is_process_local(cache=None):
+    """
+    Returns whether the cache (by default the one returned by get_cache()) is
+    a local-memory cache, which isn't shared by the processes of a server.
+    """
+    return isinstance(cache or get_cache(), LocMemCache)
+
+
+class LRUCache(object):
+    """
+    In-process cache holding the `size` most recently used values, with the
+    get(), set() and delete() methods of Django's cache backends. Values are
+    neither copied nor pickled, so they must not be changed once set.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._values.pop(key)
+            except KeyError:
+                return default
+            self._values[key] = value
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = value
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+_summary_cache = None
+summary_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_summary_cache():
+    """
+    Returns the cache configured by the TIME_TRACKING_SUMMARY_CACHE setting, 
+    or the cache returned by get_cache(), so that summaries are shared by the
+    processes of a server. If that is a local-memory cache, an in-process 
+    LRUCache of SUMMARY_CACHE_SIZE summaries is used instead, which saves 
+    pickling them.
+    """
+    global _summary_cache
+    if _summary_cache is None:
+        alias = getattr(settings, 'TIME_TRACKING_SUMMARY_CACHE', None)
+        if alias:
+            _summary_cache = get_cache_backend(alias)
+        elif is_process_local():
+            _summary_cache = LRUCache(SUMMARY_CACHE_SIZE)
+        else:
+            _summary_cache = get_cache()
+    return _summary_cache
+
+
+def get_summary_cache_stats():
+    """
+    Returns the numbers of summaries read from the cache (`hits`) and computed
+    (`misses`) by this process.
+    """
+    return dict(summary_cache_stats)
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""
+Exports clock entries, e.g. for payroll. Entries are fetched in batches, so
+that arbitrarily many entries can be exported in bounded memory.
+"""
+from time_tracking.models import Clock, ActivityOptions
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext_lazy as _
+from decimal import Decimal
+import csv
+
+BATCH_SIZE = 1000
+
+COLUMNS = (
+    _('user'), _('date'), _('start'), _('end'), _('duration'), _('hours'), 
+    _('activity'), _('project'), _('rate'), _('cost'), _('comment'),
+)
+
+
+def iter_entries(qs, batch_size=BATCH_SIZE):
+    """
+    Yields the entries of the QuerySet ordered by start, fetching them in 
+    batches using the start and pk of the last entry of the previous batch.
+    """
+    qs = qs.select_related('user', 'activity', 'project').order_by('start', 'pk')
+    last = None
+    while True:
+        batch = qs
+        if last is not None:
+            batch = batch.filter(Q(start__gt=last.start) | Q(start=last.start, pk__gt=last.pk))
+        batch = list(batch[:batch_size])
+        for entry in batch:
+            yield entry
+        if len(batch) < batch_size:
+            break
+        last = batch[-1]
+
+
+def local_datetime(value):
+    """
+    Returns the datetime in the current time zone, without time zone info.
+    """
+    if value is not None and timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.get_current_timezone())
+    return value
+
+
+def iter_rows(qs, batch_size=BATCH_SIZE):
+    """
+    Yields the column headers followed by a list of values for each entry. 
+    All rates are resolved from one RateTable instead of querying them per entry.
+    """
+    yield [force_text(column) for column in COLUMNS]
+    rates = ActivityOptions.get_rate_table()
+    for entry in iter_entries(qs, batch_size):
+        start = local_datetime(entry.start)
+        yield [
+            force_text(entry.user),
+            start.date(),
+            start,
+            local_datetime(entry.end),
+            entry.hours,
+            entry.hours_credited(),
+            force_text(entry.activity),
+            force_text(entry.project) if entry.project_id else '',
+            entry.get_rate(rates),
+            entry.get_cost(rates),
+            entry.comment,
+        ]
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written to it, for streaming csv output.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    return force_text(value).encode('utf-8')
+
+
+def iter_csv(qs, batch_size=BATCH_SIZE):
+    """
+    Yields the entries as lines of UTF-8 encoded CSV.
+    """
+    writer = csv.writer(Echo())
+    for row in iter_rows(qs, batch_size):
+        yield writer.writerow([_encode(value) for value in row])
+
+
+def write_xlsx(qs, output, batch_size=BATCH_SIZE):
+    """
+    Writes the entries to `output` (a filename or file-like object) as an Excel 
+    workbook. Requires XlsxWriter, which is used in constant memory mode.
+    """
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+    worksheet = workbook.add_worksheet()
+    for row_number, row in enumerate(iter_rows(qs, batch_size)):
+        for column_number, value in enumerate(row):
+            if value is None:
+                continue
+            if isinstance(value, (int, long, float, Decimal)):
+                worksheet.write_number(row_number, column_number, float(value))
+            else:
+                worksheet.write_string(row_number, column_number, force_text(value))
+    workbook.close()
@@ -52,6 +52,15 @@ class ClockForm(ModelForm):
                     if overlap.count() > 0:
                         raise ValidationError(mark_safe(_('Start/end are overlapping with %s.') % overlap[0].get_admin_link()))
 
+            # is the user clocked in with another entry already?
+            if 'start' in self.cleaned_data and self.cleaned_data['start'] and \
+                not self.cleaned_data.get('end') and not self.cleaned_data.get('hours'):
+                    clocked_in = Clock.objects.filter(end__isnull=True, user=user)
+                    if self.instance.pk:
+                        clocked_in = clocked_in.exclude(pk=self.instance.pk)
+                    if clocked_in.count() > 0:
+                        raise ValidationError(mark_safe(_('Please enter end or hours, since you are clocked in with %s.') % clocked_in[0].get_admin_link()))
+
         if 'hours' in self.cleaned_data and self.cleaned_data['hours'] and 'end' in self.cleaned_data and self.cleaned_data['end']:
             raise ValidationError(_('Please enter either end or hours, but not both.'))
 
@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+Imports clock entries in bulk, e.g. from badge terminals. A batch is validated
+against the existing entries fetched with a single query, and the valid 
+entries are written using bulk_create() in one transaction.
+"""
+from time_tracking.models import Clock, Activity, Project, ProjectBudgetSnapshot
+from time_tracking.signals import clock_entries_changed
+from django.contrib.auth.models import User
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext as _
+import datetime
+
+
+def parse_time(value):
+    if value in (None, ''):
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError()
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
+def parse_hours(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+class Lookup(object):
+    """
+    Resolves objects by pk or by a field (e.g. username or name), fetching all 
+    requested objects with one query.
+    """
+
+    def __init__(self, qs, field, values):
+        values = set(value for value in values if value not in (None, ''))
+        pks = set(int(value) for value in values if isinstance(value, (int, long)) or unicode(value).isdigit())
+        self.objects = {}
+        if values:
+            for obj in qs.filter(Q(pk__in=pks) | Q(**{'%s__in' % field: list(values)})):
+                self.objects[obj.pk] = self.objects[unicode(obj.pk)] = obj
+                self.objects[getattr(obj, field)] = obj
+
+    def get(self, value):
+        if value in (None, ''):
+            return None
+        if hasattr(value, 'pk'):
+            return value
+        return self.objects[value]
+
+
+def import_entries(rows, user=None, using=DEFAULT_DB_ALIAS, dry_run=False):
+    """
+    Imports clock entries from dictionaries with the keys `user` (username or 
+    pk, defaults to `user`), `start`, `end` or `hours`, `activity` and `project` 
+    (name or pk) and `comment`. Hours are computed like Clock.save() does. 
+    
+    Rows that can't be imported, e.g. because they overlap with another entry, 
+    are skipped. Returns a list of the created entries and a list of tuples with
+    the 1-based row number and the error message.
+    """
+    rows = list(rows)
+    users = Lookup(User.objects.using(using), 'username', [row.get('user') for row in rows])
+    activities = Lookup(Activity.objects.using(using), 'name', [row.get('activity') for row in rows])
+    projects = Lookup(Project._base_manager.using(using), 'name', [row.get('project') for row in rows])
+    default_activity = None
+    errors = {}
+    entries = []
+
+    for number, row in enumerate(rows, 1):
+        try:
+            try:
+                entry_user = users.get(row.get('user')) or user
+            except KeyError:
+                raise ValueError(_('Unknown user: %s') % row.get('user'))
+            if entry_user is None:
+                raise ValueError(_('Please specify a user.'))
+            try:
+                activity = activities.get(row.get('activity'))
+                project = projects.get(row.get('project'))
+            except KeyError, e:
+                raise ValueError(_('Unknown activity or project: %s') % e.args[0])
+            if activity is None:
+                if default_activity is None:
+                    default_activity = Activity.get_default()
+                activity = default_activity
+            try:
+                start = parse_time(row.get('start'))
+                end = parse_time(row.get('end'))
+                hours = parse_hours(row.get('hours'))
+            except ValueError:
+                raise ValueError(_('Invalid start, end or hours.'))
+            if start is None:
+                raise ValueError(_('Please enter a start.'))
+            if hours and end:
+                raise ValueError(_('Please enter either end or hours, but not both.'))
+            if hours is not None and hours < 0:
+                raise ValueError(_('Hours must not be negative.'))
+            if end and end <= start:
+                raise ValueError(_('End must be later than start.'))
+            # same as Clock.save()
+            if end and not hours:
+                hours = Clock.hours_between(start, end)
+            if hours and not end:
+                end = start + timezone.timedelta(hours=hours)
+            # passing all fields, since some defaults of Clock need queries
+            entry = Clock(user=entry_user, activity=activity, project=project, start=start, end=end, 
+                hours=hours, comment=row.get('comment') or '')
+            entry._import_row = number
+            entries.append(entry)
+        except ValueError, e:
+            errors[number] = unicode(e)
+
+    created = []
+    with transaction.commit_on_success(using=using):
+        if entries:
+            existing = Clock.objects.using(using).select_for_update().filter(
+                user__in=set(entry.user_id for entry in entries),
+                start__lte=max(entry.end or entry.start for entry in entries),
+                end__gt=min(entry.start for entry in entries))
+            for entry, overlap in find_overlaps(entries, existing):
+                if overlap.pk:
+                    errors[entry._import_row] = _('Overlapping with %s.') % overlap.__unicode__()
+                else:
+                    errors[entry._import_row] = _('Overlapping with row %i.') % overlap._import_row
+            # a user can only be clocked in with one entry
+            open_entries = [entry for entry in entries if not entry.end and entry._import_row not in errors]
+            if open_entries:
+                clocked_in = set(Clock.objects.using(using).filter(end__isnull=True,
+                    user__in=set(entry.user_id for entry in open_entries)).values_list('user', flat=True))
+                for entry in open_entries:
+                    if entry.user_id in clocked_in:
+                        errors[entry._import_row] = _('Already clocked in.')
+                    clocked_in.add(entry.user_id)
+            created = [entry for entry in entries if entry._import_row not in errors]
+        if created and not dry_run:
+            Clock.objects.using(using).bulk_create(created)
+            ProjectBudgetSnapshot.apply_changes([], [ProjectBudgetSnapshot.get_state(entry) for entry in created])
+            dates_per_user = {}
+            for entry in created:
+                dates_per_user.setdefault(entry.user_id, set()).add(Clock.local_date(entry.start))
+            for user_id, dates in dates_per_user.items():
+                clock_entries_changed.send(sender=Clock, user_id=user_id, dates=dates)
+
+    return created, sorted(errors.items())
+
+
+def find_overlaps(entries, existing):
+    """
+    Yields each entry of `entries` that overlaps with an existing entry or with 
+    a previous entry of the batch, together with that entry. Overlaps are found 
+    in a single sweep over the entries of each user ordered by start. Entries 
+    without end only overlap with entries they start in.
+    """
+    timeline = sorted([(entry.user_id, entry.start, 0, index, entry) for index, entry in enumerate(existing)]
+        + [(entry.user_id, entry.start, 1, index, entry) for index, entry in enumerate(entries)])
+    current_user_id = latest_existing = latest_new = None
+    for user_id, start, is_new, index, entry in timeline:
+        if user_id != current_user_id:
+            current_user_id = user_id
+            latest_existing = latest_new = None
+        # latest_existing and latest_new are the entries ending last so far
+        if is_new:
+            for other in (latest_existing, latest_new):
+                if other is not None and start < other.end:
+                    yield entry, other
+                    break
+            else:
+                if entry.end and (latest_new is None or entry.end > latest_new.end):
+                    latest_new = entry
+        else:
+            # entries of the batch don't overlap with each other, so only the 
+            # latest one can overlap with an existing entry starting later
+            if latest_new is not None and start < latest_new.end:
+                yield latest_new, entry
+                latest_new = None
+            if entry.end and (latest_existing is None or entry.end > latest_existing.end):
+                latest_existing = entry
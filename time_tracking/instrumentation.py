@@ -0,0 +1,155 @@
+"""
+Records the number of queries, database time and Python time of time_tracking
+operations. Recording is active while collecting metrics, i.e. during requests
+handled by InstrumentationMiddleware, or inside collect_metrics().
+
+Metrics are passed to the callable configured as TIME_TRACKING_METRICS_SINK 
+(a dotted path; by default they are logged to `time_tracking.instrumentation`).
+"""
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils.datastructures import SortedDict
+from django.utils.importlib import import_module
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import time
+
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
+
+_state = local()
+
+logger = logging.getLogger('time_tracking.instrumentation')
+
+
+class Metrics(object):
+    """
+    Collects metrics of the operations, and of everything in total. Queries are
+    recorded using the debug cursor of the database connection. 
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.operations = SortedDict()
+        connection = connections[using]
+        self.use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.queries_before = len(connection.queries)
+        self.started = time.time()
+        self.total = None
+
+    def add(self, name, queries, db_time, python_time):
+        operation = self.operations.setdefault(name, 
+            {'calls': 0, 'queries': 0, 'db_time': 0.0, 'python_time': 0.0})
+        operation['calls'] += 1
+        operation['queries'] += queries
+        operation['db_time'] += db_time
+        operation['python_time'] += python_time
+
+    def finish(self):
+        connection = connections[self.using]
+        queries = connection.queries[self.queries_before:]
+        connection.use_debug_cursor = self.use_debug_cursor
+        db_time = sum(float(query['time']) for query in queries)
+        self.total = {
+            'calls': 1, 
+            'queries': len(queries), 
+            'db_time': db_time, 
+            'python_time': time.time() - self.started - db_time,
+        }
+        return self.total
+
+
+def get_sink():
+    path = getattr(settings, 'TIME_TRACKING_METRICS_SINK', None)
+    if not path:
+        return log_metrics
+    module_name, attr = path.rsplit('.', 1)
+    return getattr(import_module(module_name), attr)
+
+
+def log_metrics(name, metrics, **context):
+    logger.info(' '.join(['operation=%s' % name] 
+        + ['%s=%s' % item for item in sorted(context.items())]
+        + ['calls=%(calls)i queries=%(queries)i db_time=%(db_time).4f python_time=%(python_time).4f' % metrics]))
+
+
+def is_collecting():
+    return getattr(_state, 'metrics', None) is not None
+
+
+def start_collecting(using=DEFAULT_DB_ALIAS):
+    _state.metrics = Metrics(using)
+    return _state.metrics
+
+
+def stop_collecting(**context):
+    """
+    Stops collecting, passes all metrics to the sink and returns them. The
+    `context` (e.g. the path of the request) is passed to the sink as well.
+    """
+    metrics = getattr(_state, 'metrics', None)
+    _state.metrics = None
+    if metrics is None:
+        return None
+    metrics.finish()
+    sink = get_sink()
+    for name, operation in metrics.operations.items():
+        sink(name, operation, **context)
+    sink('total', metrics.total, **context)
+    return metrics
+
+
+@contextmanager
+def collect_metrics(using=DEFAULT_DB_ALIAS, **context):
+    """
+    Collects metrics of all instrumented operations inside the block, e.g. 
+    in management commands or background jobs.
+    """
+    metrics = start_collecting(using)
+    try:
+        yield metrics
+    finally:
+        stop_collecting(**context)
+
+
+@contextmanager
+def instrument(name):
+    """
+    Records the metrics of the block as operation `name`, if metrics are being 
+    collected. Metrics of nested operations are included in the outer ones.
+    """
+    metrics = getattr(_state, 'metrics', None)
+    if metrics is None:
+        yield
+        return
+    connection = connections[metrics.using]
+    queries_before = len(connection.queries)
+    started = time.time()
+    try:
+        yield
+    finally:
+        queries = connection.queries[queries_before:]
+        db_time = sum(float(query['time']) for query in queries)
+        metrics.add(name, len(queries), db_time, time.time() - started - db_time)
+
+
+def instrumented(name, render=False):
+    """
+    Decorator recording each call of the function as operation `name`. With
+    `render`, template responses returned by the function (e.g. a view) are
+    rendered inside the operation when metrics are being collected.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with instrument(name):
+                result = function(*args, **kwargs)
+                if render and is_collecting() and hasattr(result, 'render'):
+                    result.render()
+                return result
+        return wrapper
+    return decorator
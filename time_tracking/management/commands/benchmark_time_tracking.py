@@ -0,0 +1,57 @@
+from time_tracking import benchmark
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from optparse import make_option
+import datetime
+import json
+
+
+class Command(BaseCommand):
+    help = 'Generates clock entries and measures wall time and number of queries of the hot paths ' \
+        'of time_tracking for each of the given numbers of entries. Results are printed as JSON. ' \
+        'Data with the prefix "%s" is deleted before and after running.' % benchmark.BENCHMARK_PREFIX
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='1000,10000,100000',
+            help='Comma-separated numbers of clock entries (default: 1000,10000,100000).'),
+        make_option('--users', dest='users', default=10, type='int',
+            help='Number of users (default: 10).'),
+        make_option('--projects', dest='projects', default=20, type='int',
+            help='Number of projects (default: 20).'),
+        make_option('--repeat', dest='repeat', default=3, type='int',
+            help='Number of runs of each hot path, of which the fastest is reported (default: 3).'),
+        make_option('--output', dest='output', default=None,
+            help='File to write the JSON results to. Defaults to stdout.'),
+        make_option('--keep', action='store_true', dest='keep', default=False,
+            help='Keep the data generated for the largest size, e.g. for explain_clock_queries.'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Database to use.'),
+        make_option('--noinput', action='store_false', dest='interactive', default=True,
+            help='Do not ask for confirmation.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Invalid sizes: %s' % options['sizes'])
+        if options['interactive']:
+            confirm = raw_input('This will create and delete data in the database "%s". '
+                'Type \'yes\' to continue: ' % options['database'])
+            if confirm != 'yes':
+                raise CommandError('Benchmark cancelled.')
+
+        def log(message):
+            if int(options['verbosity']) > 0:
+                self.stderr.write(message)
+
+        results = benchmark.run(sizes, users=options['users'], projects=options['projects'], 
+            repeat=options['repeat'], keep=options['keep'], using=options['database'], log=log)
+        output = json.dumps({
+            'date': datetime.datetime.now().isoformat(),
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,98 @@
+from time_tracking.models import Clock
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Count, Sum
+from django.utils import timezone
+from optparse import make_option
+import re
+
+EXPLAIN_SQL = {
+    'postgresql': 'EXPLAIN %s',
+    'sqlite': 'EXPLAIN QUERY PLAN %s',
+    'mysql': 'EXPLAIN %s',
+}
+
+
+class Command(BaseCommand):
+    help = 'Prints the query plans of the most frequent queries on clock entries, ' \
+        'optionally compared to the plans without the indexes of time_tracking.'
+    option_list = BaseCommand.option_list + (
+        make_option('--compare', action='store_true', dest='compare', default=False,
+            help='Also print the plans without the indexes, which are dropped and created '
+                'again afterwards (PostgreSQL and SQLite only). Do not use on production databases.'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Database to use.'),
+    )
+
+    def get_queries(self, using):
+        entries = Clock.objects.using(using)
+        sample = entries.values('user').annotate(count=Count('pk')).order_by('-count')[:1]
+        if not sample:
+            raise CommandError('There are no clock entries. Please seed some first, e.g. using benchmark_time_tracking.')
+        user_id = sample[0]['user']
+        latest = entries.filter(user=user_id).latest('start')
+        project_id = entries.exclude(project=None).values_list('project', flat=True)[:1]
+        month_ago = latest.start - timezone.timedelta(days=30)
+        queries = [
+            ('clocked_in_time', entries.filter(user=user_id).order_by('-start').filter(end__isnull=True)[:1]),
+            ('get_latest_value', entries.filter(user=user_id).order_by('-start')[:1]),
+            ('filter_between', Clock.filter_between(entries.filter(user=user_id), month_ago, latest.start)),
+            ('overlap', entries.filter(start__lte=latest.start, end__gt=latest.start, user=user_id)),
+            ('change_list', entries.filter(user=user_id).order_by('-start')[:100]),
+        ]
+        if project_id:
+            queries.append(('sum_cost', entries.filter(project=project_id[0]).order_by().values('user', 'activity', 
+                'activity__time_factor', 'billed_rate', 'billed_time_factor').annotate(hours_sum=Sum('hours'))))
+        return queries
+
+    def get_index_statements(self, connection):
+        """
+        Returns the names and CREATE statements of the indexes on clock entries,
+        except for those Django creates for foreign keys.
+        """
+        statements = custom_sql_for_model(Clock, no_style(), connection)
+        for field_names in Clock._meta.index_together:
+            fields = [Clock._meta.get_field(name) for name in field_names]
+            statements.extend(connection.creation.sql_indexes_for_fields(Clock, fields, no_style()))
+        indexes = []
+        for statement in statements:
+            match = re.match(r'CREATE (?:UNIQUE )?INDEX "?(\w+)"?', statement)
+            if match and match.group(1).startswith(Clock._meta.db_table):
+                indexes.append((match.group(1), statement))
+        return indexes
+
+    def explain(self, connection, queries, label):
+        cursor = connection.cursor()
+        for name, qs in queries:
+            sql, params = qs.query.get_compiler(connection=connection).as_sql()
+            # the label prevents sqlite3 from reusing the cached statement of another pass
+            cursor.execute(EXPLAIN_SQL[connection.vendor] % ('%s /* %s */' % (sql, label)), params)
+            self.stdout.write('-- %s' % name)
+            for row in cursor.fetchall():
+                self.stdout.write('   ' + ' '.join(unicode(value) for value in row))
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor not in EXPLAIN_SQL:
+            raise CommandError('Query plans are not supported for %s.' % connection.vendor)
+        queries = self.get_queries(using)
+        self.stdout.write('== With indexes')
+        self.explain(connection, queries, 'with indexes')
+
+        if options['compare']:
+            if connection.vendor not in ('postgresql', 'sqlite'):
+                raise CommandError('Comparing is only supported for PostgreSQL and SQLite.')
+            indexes = self.get_index_statements(connection)
+            cursor = connection.cursor()
+            try:
+                for name, statement in indexes:
+                    cursor.execute('DROP INDEX IF EXISTS %s' % connection.ops.quote_name(name))
+                self.stdout.write('== Without indexes')
+                self.explain(connection, queries, 'without indexes')
+            finally:
+                for name, statement in indexes:
+                    cursor.execute(statement)
+                transaction.commit_unless_managed(using=using)
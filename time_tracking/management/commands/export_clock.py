@@ -0,0 +1,53 @@
+from time_tracking import export
+from time_tracking.models import Clock, Project
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from optparse import make_option
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Exports clock entries as CSV or Excel file.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv', choices=['csv', 'xlsx'],
+            help='Output format: csv (default) or xlsx.'),
+        make_option('--output', dest='output', default=None,
+            help='Output file. Defaults to stdout for csv.'),
+        make_option('--user', action='append', dest='usernames', default=[],
+            help='Only export entries of this user. May be given multiple times.'),
+        make_option('--project', dest='project', default=None, type='int',
+            help='Only export entries of the project with this id.'),
+        make_option('--from', dest='from_date', default=None,
+            help='Only export entries starting on or after this date (YYYY-MM-DD).'),
+        make_option('--to', dest='to_date', default=None,
+            help='Only export entries starting before this date (YYYY-MM-DD).'),
+    )
+
+    def handle(self, *args, **options):
+        qs = Clock.objects.all()
+        if options['usernames']:
+            qs = qs.filter(user__username__in=options['usernames'])
+        if options['project']:
+            qs = qs.filter(project=options['project'])
+        for option, lookup in (('from_date', 'start__gte'), ('to_date', 'start__lt')):
+            if options[option]:
+                date = parse_date(options[option])
+                if not date:
+                    raise CommandError('Invalid date: %s' % options[option])
+                qs = qs.filter(**{lookup: Clock.start_of_day(date)})
+
+        if options['format'] == 'xlsx':
+            if not options['output']:
+                raise CommandError('Please specify an output file for xlsx.')
+            try:
+                export.write_xlsx(qs, options['output'])
+            except ImportError:
+                raise CommandError('Please install XlsxWriter in order to export Excel files.')
+        else:
+            output = open(options['output'], 'wb') if options['output'] else sys.stdout
+            try:
+                for line in export.iter_csv(qs):
+                    output.write(line)
+            finally:
+                if options['output']:
+                    output.close()
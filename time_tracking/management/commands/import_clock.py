@@ -0,0 +1,50 @@
+from time_tracking.importer import import_entries
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import csv
+import json
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Imports clock entries from a CSV file with a header row, or from a JSON list of objects. ' \
+        'Columns/keys: user, start, end, hours, activity, project, comment.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None, choices=['csv', 'json'],
+            help='Input format: csv or json. Defaults to the file extension.'),
+        make_option('--user', dest='username', default=None,
+            help='User for rows that do not specify one.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only validate the entries.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Please specify the file to import.')
+        filename = args[0]
+        format = options['format'] or filename.rsplit('.', 1)[-1].lower()
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('Unknown user: %s' % options['username'])
+
+        with open(filename, 'rb') as f:
+            if format == 'csv':
+                rows = [dict((key, value.decode('utf-8')) for key, value in row.items()) 
+                    for row in csv.DictReader(f)]
+            elif format == 'json':
+                rows = json.load(f)
+            else:
+                raise CommandError('Unknown format: %s' % format)
+
+        created, errors = import_entries(rows, user=user, dry_run=options['dry_run'])
+        for number, message in errors:
+            self.stderr.write('Row %i: %s' % (number, message))
+        if int(options['verbosity']) > 0:
+            if options['dry_run']:
+                self.stdout.write('%i entries valid, %i errors' % (len(created), len(errors)))
+            else:
+                self.stdout.write('%i entries imported, %i errors' % (len(created), len(errors)))
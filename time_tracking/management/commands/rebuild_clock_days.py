@@ -0,0 +1,21 @@
+from time_tracking.models import ClockDay, ClockBalance
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily and running totals of the clock entries.'
+    option_list = BaseCommand.option_list + (
+        make_option('--user', action='append', dest='usernames', default=[],
+            help='Only recompute the totals of this user. May be given multiple times.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+            ClockDay.rebuild(users)
+        else:
+            ClockDay.rebuild()
+        if int(options['verbosity']) > 0:
+            self.stdout.write('%i daily totals, %i running totals' % (ClockDay.objects.count(), ClockBalance.objects.count()))
@@ -0,0 +1,21 @@
+from time_tracking.models import Project, ProjectBudgetSnapshot
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the budget snapshots of all projects, e.g. periodically or after changing ' \
+        'clock entries in bulk.'
+    option_list = BaseCommand.option_list + (
+        make_option('--stale', action='store_true', dest='stale', default=False,
+            help='Only recompute stale and missing snapshots.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            projects = Project._base_manager.exclude(budget_snapshot__stale=False)
+            ProjectBudgetSnapshot.refresh(projects.values_list('pk', flat=True))
+        else:
+            ProjectBudgetSnapshot.refresh()
+        if int(options['verbosity']) > 0:
+            self.stdout.write('%i budget snapshots' % ProjectBudgetSnapshot.objects.count())
@@ -0,0 +1,37 @@
+from time_tracking import benchmark
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import json
+
+
+class Command(BaseCommand):
+    help = 'Clocks generated users in and out from concurrent threads and checks that no user ' \
+        'is clocked in with more than one entry. Data with the prefix "%s" is deleted before and ' \
+        'after running.' % benchmark.BENCHMARK_PREFIX
+    option_list = BaseCommand.option_list + (
+        make_option('--users', dest='users', default=2, type='int',
+            help='Number of users (default: 2).'),
+        make_option('--threads', dest='threads', default=8, type='int',
+            help='Number of concurrent threads (default: 8).'),
+        make_option('--iterations', dest='iterations', default=50, type='int',
+            help='Number of operations per thread (default: 50).'),
+        make_option('--noinput', action='store_false', dest='interactive', default=True,
+            help='Do not ask for confirmation.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            confirm = raw_input('This will create and delete data in the default database. '
+                'Type \'yes\' to continue: ')
+            if confirm != 'yes':
+                raise CommandError('Stress test cancelled.')
+
+        def log(message):
+            if int(options['verbosity']) > 1:
+                self.stderr.write(message)
+
+        result = benchmark.stress_clock_in(users=options['users'], threads=options['threads'],
+            iterations=options['iterations'], log=log)
+        self.stdout.write(json.dumps(result, indent=2))
+        if result['duplicates']:
+            raise CommandError('Users clocked in with more than one entry: %s' % result['duplicates'])
@@ -1,23 +1,139 @@
 from django.contrib.auth.models import AnonymousUser
+from time_tracking import instrumentation
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
 
 try:
     from threading import local
 except ImportError:
     from django.utils._threading_local import local
 
-_thread_locals = local()
+
+class ThreadLocalVar(object):
+    """
+    Stands in for contextvars.ContextVar where it is not available, storing
+    the value per thread. set() returns the previous value as token.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self.local = local()
+
+    def get(self):
+        return getattr(self.local, 'value', self.default)
+
+    def set(self, value):
+        token = self.get()
+        self.local.value = value
+        return token
+
+    def reset(self, token):
+        self.local.value = token
+
+
+if ContextVar is not None:
+    _current_user = ContextVar('time_tracking_current_user', default=None)
+    _request_cache = ContextVar('time_tracking_request_cache', default=None)
+else:
+    _current_user = ThreadLocalVar('time_tracking_current_user')
+    _request_cache = ThreadLocalVar('time_tracking_request_cache')
+
+
+@contextmanager
+def acting_as(user):
+    """
+    Context manager making `user` the current user, with a cache of its own,
+    e.g. for background jobs and management commands. The previous user is 
+    restored on exit.
+    """
+    user_token = _current_user.set(user)
+    cache_token = _request_cache.set({})
+    try:
+        yield user
+    finally:
+        _request_cache.reset(cache_token)
+        _current_user.reset(user_token)
+
+
+def with_current_user(function):
+    """
+    Returns a function calling `function` on behalf of the current user, for 
+    passing to thread pools and other executors, whose threads don't inherit 
+    the current user.
+    """
+    user = _current_user.get()
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with acting_as(user):
+            return function(*args, **kwargs)
+    return wrapper
+
 
 class CurrentUserMiddleware(object):
     """Middleware that gets user object from the
-    request object and saves it in thread local storage."""
+    request object and makes it the current user until the end of the request.
+    Also provides a cache that is cleared at the end of each request."""
 
     def process_request(self, request):
-        _thread_locals.user = getattr(request, 'user', None)
+        request._current_user_tokens = (_current_user.set(getattr(request, 'user', None)),
+            _request_cache.set({}))
+
+    def process_response(self, request, response):
+        tokens = getattr(request, '_current_user_tokens', None)
+        if tokens is not None:
+            del request._current_user_tokens
+            _request_cache.reset(tokens[1])
+            _current_user.reset(tokens[0])
+        return response
 
     @staticmethod
     def get_current_user():
-        return getattr(_thread_locals, 'user', AnonymousUser())
+        return _current_user.get() or AnonymousUser()
 
     @staticmethod
     def get_current_user_groups():
         return CurrentUserMiddleware.get_current_user().groups.all()
+
+    @staticmethod
+    def get_request_cache():
+        """
+        Returns a dictionary for values that may be cached until the end of the
+        current request. Outside of requests, nothing is cached.
+        """
+        cache = _request_cache.get()
+        if cache is None:
+            return {}
+        return cache
+
+    @staticmethod
+    def clear_request_cache():
+        cache = _request_cache.get()
+        if cache is not None:
+            cache.clear()
+
+
+class InstrumentationMiddleware(object):
+    """Middleware that records queries, database time and Python time of 
+    each request and of the time_tracking operations it performs, passes 
+    them to the metrics sink and adds them to the response headers."""
+
+    def process_request(self, request):
+        instrumentation.start_collecting()
+
+    def process_response(self, request, response):
+        metrics = instrumentation.stop_collecting(path=request.path, method=request.method)
+        if metrics is not None:
+            response['X-Time-Tracking-Queries'] = str(metrics.total['queries'])
+            response['X-Time-Tracking-DB-Time'] = '%.4f' % metrics.total['db_time']
+            response['X-Time-Tracking-Python-Time'] = '%.4f' % metrics.total['python_time']
+            if metrics.operations:
+                response['Server-Timing'] = ', '.join(['%s;dur=%.1f;desc="%i queries"' % (name, 
+                    (operation['db_time'] + operation['python_time']) * 1000, operation['queries']) 
+                    for name, operation in metrics.operations.items()])
+        return response
@@ -1,7 +1,7 @@
 # coding=utf-8
 from time_tracking.middleware import CurrentUserMiddleware
 from time_tracking.settings import *
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
 from django.contrib.auth.models import User, Group
 from django.utils.translation import ugettext_lazy as _, ugettext
 from django.utils import timezone
@@ -12,7 +12,19 @@ from django.core.urlresolvers import reverse
 from django.utils.safestring import mark_safe
 from django.utils.text import capfirst
 from django.core.exceptions import ValidationError
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.db.backends.util import typecast_timestamp
+from django.utils.dateparse import parse_date
+from django.utils.encoding import force_bytes
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from time_tracking.signals import clock_entries_changed
+from time_tracking.instrumentation import instrumented, instrument
+from time_tracking.cache import get_cache, get_summary_cache, summary_cache_stats, is_process_local
 import datetime
+import hashlib
+import uuid
 
 
 if not 'time_tracking.middleware.CurrentUserMiddleware' in settings.MIDDLEWARE_CLASSES:
@@ -41,11 +53,20 @@ class TimeTrackingGroup(Group):
             
     @staticmethod
     def get_allowed_for_current_user():
-        if not CurrentUserMiddleware.get_current_user().is_superuser:
-            groups = CurrentUserMiddleware.get_current_user_groups()
-        else:
-            groups = Group.objects.all()
-        return [group.pk for group in groups]
+        """
+        Returns the pks of the groups of the current user, or of all groups for
+        superusers, cached until the end of the request.
+        """
+        user = CurrentUserMiddleware.get_current_user()
+        cache = CurrentUserMiddleware.get_request_cache()
+        key = ('allowed_groups', user.pk)
+        if key not in cache:
+            if not user.is_superuser:
+                groups = CurrentUserMiddleware.get_current_user_groups()
+            else:
+                groups = Group.objects.all()
+            cache[key] = list(groups.values_list('pk', flat=True))
+        return cache[key]
 
 
 class GroupAllowedForCurrentUserManager(models.Manager):
@@ -56,10 +77,34 @@ class GroupAllowedForCurrentUserManager(models.Manager):
 
     def get_query_set(self):
         qs = super(GroupAllowedForCurrentUserManager, self).get_query_set()
-        if not CurrentUserMiddleware.get_current_user().is_superuser:
-            qs = qs.filter(groups__pk__in=TimeTrackingGroup.get_allowed_for_current_user())
+        user = CurrentUserMiddleware.get_current_user()
+        if not user.is_superuser:
+            qs = qs.extra(where=[self.get_allowed_sql()], params=[user.pk])
         return qs
 
+    def get_allowed_sql(self):
+        """
+        Returns an EXISTS condition that is true for objects assigned a group of 
+        the user passed as parameter. Unlike a join, it doesn't return objects 
+        assigned several of those groups more than once, and it doesn't need 
+        the groups of the user to be fetched first.
+        """
+        qn = connections[self.db].ops.quote_name
+        groups = self.model._meta.get_field('groups')
+        user_groups = User._meta.get_field('groups')
+        return 'EXISTS (SELECT 1 FROM %(groups)s INNER JOIN %(user_groups)s ' \
+            'ON %(user_groups)s.%(user_group)s = %(groups)s.%(group)s ' \
+            'WHERE %(groups)s.%(object)s = %(table)s.%(pk)s AND %(user_groups)s.%(user)s = %%s)' % {
+                'groups': qn(groups.m2m_db_table()),
+                'group': qn(groups.m2m_reverse_name()),
+                'object': qn(groups.m2m_column_name()),
+                'user_groups': qn(user_groups.m2m_db_table()),
+                'user_group': qn(user_groups.m2m_reverse_name()),
+                'user': qn(user_groups.m2m_column_name()),
+                'table': qn(self.model._meta.db_table),
+                'pk': qn(self.model._meta.pk.column),
+            }
+
 
 class Activity(models.Model):
     
@@ -133,27 +178,85 @@ class Project(models.Model):
 
     @staticmethod
     def get_pk_for_current_user():
-        return [project.pk for project in Project.get_queryset_for_current_user()]
+        cache = CurrentUserMiddleware.get_request_cache()
+        key = ('allowed_projects', CurrentUserMiddleware.get_current_user().pk)
+        if key not in cache:
+            cache[key] = list(Project.get_queryset_for_current_user().values_list('pk', flat=True))
+        return cache[key]
         
     @staticmethod
     def get_latest_for_current_user():
         return Clock.get_latest_value('project', include_null=True)
 
+    @staticmethod
+    def annotate_totals(qs):
+        """
+        Annotates each project of the QuerySet with `hours_sum`, `cost_sum`,
+        `budget_balance` and `budget_coverage`, so that no further queries are 
+        needed for displaying them. 
+        """
+        qs = Clock.annotate_cost(Clock.annotate_hours(qs, 'project'), 'project')
+        qn = connections[qs.db].ops.quote_name
+        cost = qs.query.extra['cost_sum'][0]
+        budget = '%s.%s' % (qn(Project._meta.db_table), qn(Project._meta.get_field('budget').column))
+        balance = 'CASE WHEN %(budget)s > 0 AND %(cost)s > 0 THEN %(budget)s - %(cost)s END' % {
+            'budget': budget, 'cost': cost}
+        return qs.extra(select={
+            'budget_balance': balance,
+            'budget_coverage': '(%s) / %s' % (balance, budget),
+        })
+
+    def get_budget_snapshot(self):
+        """
+        Returns the ProjectBudgetSnapshot of the project, or None if there is 
+        none or it is stale. Use select_related('budget_snapshot') when 
+        querying many projects.
+        """
+        try:
+            snapshot = self.budget_snapshot
+        except ProjectBudgetSnapshot.DoesNotExist:
+            return None
+        if not snapshot.stale:
+            return snapshot
+
+    def budget_stale(self):
+        return self.get_budget_snapshot() is None
+    budget_stale.short_description = _('budget outdated')
+    budget_stale.boolean = True
+
     def sum_hours(self):
+        if hasattr(self, 'hours_sum'):
+            return self.hours_sum
+        snapshot = self.get_budget_snapshot()
+        if snapshot:
+            return snapshot.hours
         return Clock.sum_hours(Clock.objects.filter(project=self))
     sum_hours.short_description = _('hours spent')
 
     def sum_cost(self):
+        if hasattr(self, 'cost_sum'):
+            return float(self.cost_sum)
+        snapshot = self.get_budget_snapshot()
+        if snapshot:
+            return snapshot.cost
         return Clock.sum_cost(Clock.objects.filter(project=self))
     sum_cost.short_description = _('budget spent')
 
     def balance(self):
+        if not hasattr(self, 'cost_sum'):
+            snapshot = self.get_budget_snapshot()
+            if snapshot:
+                return snapshot.balance
         cost_sum = self.sum_cost()
         if self.budget > 0 and cost_sum > 0:
             return float(self.budget) - cost_sum
     balance.short_description = _('balance')
 
     def coverage(self):
+        if not hasattr(self, 'cost_sum'):
+            snapshot = self.get_budget_snapshot()
+            if snapshot:
+                return snapshot.coverage
         balance = self.balance()
         if balance != None:
             return balance / float(self.budget)
@@ -193,11 +296,11 @@ class AbstractUserOptions(models.Model):
         Returns model instance for specific user (if omitted, instance for current user is returned).
         If no specific instance exists, default instance for all users is returned.
         """
+        if not for_user:
+            for_user = CurrentUserMiddleware.get_current_user()
         if qs is None:
-            qs = klass.objects.all()
+            return klass.select_for_user(klass.get_cached_for_user(for_user), for_user)
         try:
-            if not for_user:
-                for_user = CurrentUserMiddleware.get_current_user()
             return qs.filter(user=for_user)[0]
         except IndexError:
             try:
@@ -205,6 +308,60 @@ class AbstractUserOptions(models.Model):
             except IndexError:
                 raise klass.DoesNotExist()
 
+    @classmethod
+    def get_cached_for_user(klass, for_user):
+        """
+        Returns all instances for the specific user and for all users, cached until 
+        the end of the current request.
+        """
+        user_id = getattr(for_user, 'pk', for_user)
+        cache = CurrentUserMiddleware.get_request_cache()
+        key = (klass.__name__, user_id)
+        if key not in cache:
+            cache[key] = list(klass.objects.filter(Q(user=user_id) | Q(user=None)))
+        return cache[key]
+
+    @classmethod
+    def select_for_user(klass, instances, for_user):
+        """
+        Returns the instance for the specific user from the given ones, falling back 
+        to the instance for all users.
+        """
+        user_id = getattr(for_user, 'pk', for_user)
+        default = None
+        for instance in instances:
+            if instance.user_id == user_id:
+                return instance
+            if instance.user_id is None and default is None:
+                default = instance
+        if default is None:
+            raise klass.DoesNotExist()
+        return default
+
+
+class RateTable(object):
+    """
+    Maps users and activities to hourly rates. Rates that were not defined for a
+    specific user fall back to the rate defined for all users, just like
+    ActivityOptions.get_for_activity() does.
+    """
+
+    def __init__(self, options=()):
+        self.rates = {}
+        for user_id, activity_id, rate in options:
+            self.rates[(user_id, activity_id)] = rate
+
+    def get_rate(self, user, activity):
+        """
+        Accepts model instances as well as primary keys.
+        """
+        user_id = getattr(user, 'pk', user)
+        activity_id = getattr(activity, 'pk', activity)
+        try:
+            return self.rates[(user_id, activity_id)]
+        except KeyError:
+            return self.rates.get((None, activity_id))
+
 
 class ActivityOptions(AbstractUserOptions):
 
@@ -219,10 +376,29 @@ class ActivityOptions(AbstractUserOptions):
     @classmethod
     def get_for_activity(klass, activity, for_user=None, qs=None):
         if qs is None:
-            qs = klass.objects.all()
+            if not for_user:
+                for_user = CurrentUserMiddleware.get_current_user()
+            activity_id = getattr(activity, 'pk', activity)
+            return klass.select_for_user([options for options in klass.get_cached_for_user(for_user) 
+                if options.activity_id == activity_id], for_user)
         qs = qs.filter(activity=activity)
         return klass.get_for_user(for_user=for_user, qs=qs)
 
+    @classmethod
+    def get_rate_table(klass, users=None, activities=None, qs=None):
+        """
+        Returns a RateTable for the given users and activities (if omitted, for 
+        all of them), including the rates defined for all users. Only one query 
+        is executed regardless of the number of users and activities.
+        """
+        if qs is None:
+            qs = klass.objects.all()
+        if users is not None:
+            qs = qs.filter(Q(user__in=list(users)) | Q(user=None))
+        if activities is not None:
+            qs = qs.filter(activity__in=list(activities))
+        return RateTable(qs.values_list('user', 'activity', 'rate'))
+
 
 class ClockOptions(AbstractUserOptions):
     # todo: Prevent deleting default object (user==None)
@@ -278,10 +454,51 @@ class ClockOptions(AbstractUserOptions):
             result += format_date(SUNDAY + timezone.timedelta(days=weekday - 1), WEEKDAY_FORMAT)
         return result
     working_days_formatted.short_description = _('working days')
+
+    def count_working_days(self, start, end, holidays=None):
+        """
+        Returns the number of working days from `start` to `end` (inclusive), 
+        not counting public holidays. Only the date part of datetimes is used.
+        Holidays are queried unless a list of their dates is passed.
+        """
+        start = datetime.date(start.year, start.month, start.day)
+        end = datetime.date(end.year, end.month, end.day)
+        if end < start:
+            return 0
+        working_days = self.working_days
+        full_weeks, remaining_days = divmod((end - start).days + 1, 7)
+        working_days_total = full_weeks * len(working_days)
+        for offset in range(remaining_days):
+            if Clock.django_week_day(start + timezone.timedelta(days=offset)) in working_days:
+                working_days_total += 1
+        if holidays is None:
+            holidays = Holiday.get_dates(start, end)
+        for date in holidays:
+            if start <= date <= end and Clock.django_week_day(date) in working_days:
+                working_days_total -= 1
+        return working_days_total
             
 ClockOptions.contribute_working_days_fields()
 
 
+class Holiday(models.Model):
+
+    date = models.DateField(_('date'), unique=True)
+    name = models.CharField(_('name'), max_length=255)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name = _('public holiday')
+        verbose_name_plural = _('public holidays')
+
+    def __unicode__(self):
+        return u'%s %s' % (format_date(self.date, DATE_FORMAT), self.name)
+
+    @staticmethod
+    def get_dates(start, end):
+        return Holiday.objects.filter(date__gte=start, date__lte=end).values_list('date', flat=True)
+
+
 class Clock(models.Model):
     # todo: Move validation from form to model so that it also works with clocking in / out
     # todo: Clearing end should reset hours
@@ -304,8 +521,21 @@ class Clock(models.Model):
         from billing.models import ClockBill
         bill = models.ForeignKey(ClockBill, verbose_name=_('bill'), editable=False, null=True, blank=True, on_delete=models.SET_NULL)
 
+    CLOCKED_IN_CACHE_KEY = 'time_tracking:clocked_in:%s'
+    LIVE_BASELINE_CACHE_KEY = 'time_tracking:live_baseline:%s:%s:%s'
+    SUMMARY_CACHE_KEY = 'time_tracking:summary:%s:%s:%s'
+    SUMMARY_VERSION_KEY = 'time_tracking:summary_version:%s:%s:%s'
+    NOT_CLOCKED_IN = 0
+
     class Meta:
         ordering = ['start']
+        # more indexes are created by sql/clock.<backend>.sql
+        index_together = [
+            ['user', 'start'],
+            ['user', 'end'],
+            ['project', 'activity'],
+            ['start', 'id'],
+        ]
         verbose_name = _('clock entry')
         verbose_name_plural = _('clock entries')
         permissions = (
@@ -320,28 +550,126 @@ class Clock(models.Model):
             (capfirst(self._meta.verbose_name), self.get_admin_url(), self.__unicode__()))
 
     @staticmethod
+    @instrumented('clocked_in_time')
     def clocked_in_time(user):
+        """
+        Returns the entry the user is currently clocked in with, or None. The 
+        result is cached until an entry of the user is saved or deleted.
+        """
+        user_id = getattr(user, 'pk', user)
+        time = get_cache().get(Clock.CLOCKED_IN_CACHE_KEY % user_id)
+        if time is None:
+            time = Clock._get_clocked_in_time(user_id)
+            Clock._set_clocked_in_time(user_id, time)
+        elif time == Clock.NOT_CLOCKED_IN:
+            time = None
+        return time
+
+    @staticmethod
+    def _get_clocked_in_time(user_id):
         try:
-            time = Clock.objects.filter(user=user
+            return Clock.objects.filter(user=user_id
                 ).order_by('-start'
                 ).filter(end__isnull=True)[:1].get()
-        except:
-            time = None
-        return time
+        except Clock.DoesNotExist:
+            return None
+
+    @staticmethod
+    def _set_clocked_in_time(user_id, time):
+        get_cache().set(Clock.CLOCKED_IN_CACHE_KEY % user_id, time or Clock.NOT_CLOCKED_IN, None)
+
+    @staticmethod
+    def forget_clocked_in_time(user_id):
+        get_cache().delete(Clock.CLOCKED_IN_CACHE_KEY % user_id)
+
+    @staticmethod
+    def get_clocked_in_times(users):
+        """
+        Returns a dictionary mapping the pks of those of the given users who are 
+        currently clocked in to their entries. Needs a single cache read if all
+        users are cached, and a single query for all other users.
+        """
+        user_ids = [getattr(user, 'pk', user) for user in users]
+        cached = get_cache().get_many([Clock.CLOCKED_IN_CACHE_KEY % user_id for user_id in user_ids])
+        times = {}
+        missing = []
+        for user_id in user_ids:
+            time = cached.get(Clock.CLOCKED_IN_CACHE_KEY % user_id)
+            if time is None:
+                missing.append(user_id)
+            elif time != Clock.NOT_CLOCKED_IN:
+                times[user_id] = time
+        if missing:
+            # ordered by start, so that the latest entry of each user wins
+            for time in Clock.objects.filter(user__in=missing, end__isnull=True).select_related('project', 'activity').order_by('start'):
+                times[time.user_id] = time
+            get_cache().set_many(dict((Clock.CLOCKED_IN_CACHE_KEY % user_id, times.get(user_id) or Clock.NOT_CLOCKED_IN) 
+                for user_id in missing), None)
+        return times
 
     def clock_out(self):
         self.end = timezone.now()
         self.save()
 
     @staticmethod
-    def clock_in(user, project=None):
-        clock_in_time = Clock()
-        clock_in_time.start = timezone.now()
-        clock_in_time.end = None
-        clock_in_time.user = user
-        clock_in_time.project = project
-        clock_in_time.save()
-        return clock_in_time
+    def run_clocked(user, operation, retries=CLOCK_RETRIES):
+        """
+        Calls `operation` with the entry the user is clocked in with (or None),
+        which returns a tuple of its result and the entry the user is clocked 
+        in with afterwards, and returns the result. This happens in a transaction that locks the row
+        of the user, so that concurrent calls for the same user are serialized. 
+        If a concurrent call still clocked the user in, the unique index on the
+        entries without end raises an IntegrityError, and the operation is 
+        retried. The cache is updated once the transaction is committed.
+        """
+        user_id = getattr(user, 'pk', user)
+        for attempt in range(retries + 1):
+            try:
+                with transaction.commit_on_success():
+                    User.objects.select_for_update().get(pk=user_id)
+                    result, clocked_in_time = operation(Clock._get_clocked_in_time(user_id))
+                break
+            except IntegrityError:
+                if attempt == retries:
+                    raise
+        Clock._set_clocked_in_time(user_id, clocked_in_time)
+        return result
+
+    @staticmethod
+    @instrumented('clock_in')
+    def clock_in(user, project=None, switch=False):
+        """
+        Clocks the user into the project, unless the user is clocked in already.
+        With `switch`, the user is clocked out of an entry of another project 
+        first. Returns a tuple of the new entry, or None if the user stays 
+        clocked in, and the entry that was clocked out of, or None.
+        """
+        def clock_in(clocked_in_time):
+            if clocked_in_time:
+                if not switch or clocked_in_time.project == project:
+                    return (None, None), clocked_in_time
+                clocked_in_time.clock_out()
+            clock_in_time = Clock()
+            clock_in_time.start = timezone.now()
+            clock_in_time.end = None
+            clock_in_time.user = user
+            clock_in_time.project = project
+            clock_in_time.save()
+            return (clock_in_time, clocked_in_time), clock_in_time
+        return Clock.run_clocked(user, clock_in)
+
+    @staticmethod
+    @instrumented('clock_out')
+    def clock_out_user(user):
+        """
+        Clocks the user out and returns the entry, or None if the user isn't
+        clocked in.
+        """
+        def clock_out(clocked_in_time):
+            if clocked_in_time:
+                clocked_in_time.clock_out()
+            return clocked_in_time, None
+        return Clock.run_clocked(user, clock_out)
 
     def save(self):
         user = None
@@ -376,16 +704,11 @@ class Clock(models.Model):
         return date.isoweekday() % 7 + 1
 
     @staticmethod
-    def sum_working_days(start, end):
-        test_date = timezone.make_aware(datetime.datetime(start.year, start.month, start.day, 0, 0, 0), timezone.get_default_timezone())
-        end_date = timezone.make_aware(datetime.datetime(end.year, end.month, end.day, 0, 0, 0), timezone.get_default_timezone())
-        working_days_total = 0
-        working_days = ClockOptions.get_for_user().working_days
-        while (test_date <= end_date):
-            if Clock.django_week_day(test_date) in working_days:
-                working_days_total += 1
-            test_date += timezone.timedelta(days=1)
-        return working_days_total
+    @instrumented('sum_working_days')
+    def sum_working_days(start, end, clock_options=None):
+        if clock_options is None:
+            clock_options = ClockOptions.get_for_user()
+        return clock_options.count_working_days(start, end)
 
     @staticmethod
     def filter_between(qs, from_date=None, to_date=None):
@@ -396,39 +719,204 @@ class Clock(models.Model):
         return qs
         
     @staticmethod
+    def weighted_hours_sql(where, using=DEFAULT_DB_ALIAS):
+        """
+        Returns a query computing SUM(hours * time_factor) of all entries 
+        matching the given SQL condition.
+        """
+        qn = connections[using].ops.quote_name
+        return 'SELECT SUM(%(clock)s.%(hours)s * %(activity)s.%(time_factor)s) FROM %(clock)s ' \
+            'INNER JOIN %(activity)s ON %(activity)s.%(activity_pk)s = %(clock)s.%(activity_fk)s ' \
+            'WHERE %(where)s' % {
+                'clock': qn(Clock._meta.db_table),
+                'hours': qn(Clock._meta.get_field('hours').column),
+                'activity_fk': qn(Clock._meta.get_field('activity').column),
+                'activity': qn(Activity._meta.db_table),
+                'activity_pk': qn(Activity._meta.pk.column),
+                'time_factor': qn(Activity._meta.get_field('time_factor').column),
+                'where': where,
+            }
+
+    @staticmethod
+    def annotate_hours(qs, field, name='hours_sum'):
+        """
+        Annotates each object of the QuerySet with the hours credited to it, 
+        where `field` is the name of the Clock field referencing the QuerySet's 
+        model, e.g. Clock.annotate_hours(Project.objects.all(), 'project').
+        """
+        qn = connections[qs.db].ops.quote_name
+        where = '%s.%s = %s.%s' % (
+            qn(Clock._meta.db_table), qn(Clock._meta.get_field(field).column),
+            qn(qs.model._meta.db_table), qn(qs.model._meta.pk.column))
+        return qs.extra(select={name: 'COALESCE((%s), 0)' % Clock.weighted_hours_sql(where, qs.db)})
+
+    @staticmethod
+    def cost_sql(where, using=DEFAULT_DB_ALIAS):
+        """
+        Returns a query computing the total cost of all entries matching the 
+        given SQL condition, honoring frozen rates and time factors, and falling 
+        back to the rate defined for all users if there is none for the user.
+        """
+        qn = connections[using].ops.quote_name
+        return 'SELECT SUM(%(clock)s.%(hours)s ' \
+            '* COALESCE(%(clock)s.%(billed_time_factor)s, %(activity)s.%(time_factor)s) ' \
+            '* COALESCE(%(clock)s.%(billed_rate)s, ' \
+                '(SELECT MIN(%(options)s.%(rate)s) FROM %(options)s WHERE %(options)s.%(options_activity)s = %(clock)s.%(activity_fk)s ' \
+                    'AND %(options)s.%(options_user)s = %(clock)s.%(user_fk)s), ' \
+                '(SELECT MIN(%(options)s.%(rate)s) FROM %(options)s WHERE %(options)s.%(options_activity)s = %(clock)s.%(activity_fk)s ' \
+                    'AND %(options)s.%(options_user)s IS NULL))) ' \
+            'FROM %(clock)s INNER JOIN %(activity)s ON %(activity)s.%(activity_pk)s = %(clock)s.%(activity_fk)s ' \
+            'WHERE %(where)s' % {
+                'clock': qn(Clock._meta.db_table),
+                'hours': qn(Clock._meta.get_field('hours').column),
+                'user_fk': qn(Clock._meta.get_field('user').column),
+                'activity_fk': qn(Clock._meta.get_field('activity').column),
+                'billed_rate': qn(Clock._meta.get_field('billed_rate').column),
+                'billed_time_factor': qn(Clock._meta.get_field('billed_time_factor').column),
+                'activity': qn(Activity._meta.db_table),
+                'activity_pk': qn(Activity._meta.pk.column),
+                'time_factor': qn(Activity._meta.get_field('time_factor').column),
+                'options': qn(ActivityOptions._meta.db_table),
+                'options_user': qn(ActivityOptions._meta.get_field('user').column),
+                'options_activity': qn(ActivityOptions._meta.get_field('activity').column),
+                'rate': qn(ActivityOptions._meta.get_field('rate').column),
+                'where': where,
+            }
+
+    @staticmethod
+    def annotate_cost(qs, field, name='cost_sum'):
+        """
+        Annotates each object of the QuerySet with the cost of the entries
+        referencing it, see annotate_hours().
+        """
+        qn = connections[qs.db].ops.quote_name
+        where = '%s.%s = %s.%s' % (
+            qn(Clock._meta.db_table), qn(Clock._meta.get_field(field).column),
+            qn(qs.model._meta.db_table), qn(qs.model._meta.pk.column))
+        return qs.extra(select={name: 'COALESCE((%s), 0)' % Clock.cost_sql(where, qs.db)})
+
+    @staticmethod
+    def pk_in_sql(qs):
+        """
+        Returns an SQL condition matching the entries of the QuerySet and its
+        parameters, or None if the QuerySet is empty. 
+        """
+        if isinstance(qs, EmptyQuerySet):
+            return None
+        try:
+            pk_sql, params = qs.order_by().values('pk').query.get_compiler(using=qs.db).as_sql()
+        except EmptyResultSet:
+            return None
+        qn = connections[qs.db].ops.quote_name
+        return '%s.%s IN (%s)' % (qn(Clock._meta.db_table), qn(Clock._meta.pk.column), pk_sql), params
+
+    @staticmethod
+    @instrumented('sum_hours')
     def sum_hours(qs, from_date=None, to_date=None):
+        """
+        Returns the hours of all entries multiplied by their activity's time 
+        factor, computed by the database in a single statement.
+        """
         times = Clock.filter_between(qs, from_date, to_date).exclude(hours=None)
-        distinct_time_factors = times.values('activity__time_factor').annotate(count=models.Count('pk'))
-        hours_sum = 0
-        for item in distinct_time_factors:
-            factor = item['activity__time_factor']
-            hours_sum += times.filter(activity__time_factor=factor).aggregate(models.Sum('hours'))['hours__sum'] * factor
-        return hours_sum
+        condition = Clock.pk_in_sql(times)
+        if condition is None:
+            return 0
+        where, params = condition
+        cursor = connections[times.db].cursor()
+        cursor.execute(Clock.weighted_hours_sql(where, times.db), params)
+        return cursor.fetchone()[0] or 0
 
     @staticmethod
+    @instrumented('sum_cost')
     def sum_cost(qs, from_date=None, to_date=None):
-        # TODO Optimize this method with fewer queries
+        """
+        Returns the total cost of all entries in the QuerySet, using one grouped 
+        aggregate query plus one query for the rates of all users and activities 
+        involved. Frozen rates and time factors of billed entries take precedence.
+        """
         times = Clock.filter_between(qs, from_date, to_date).exclude(hours=None)
-        distinct_activities = times.values('activity').annotate(count=models.Count('pk'))
+        # group by everything the cost depends on; order_by() prevents the default 
+        # ordering from being added to the GROUP BY clause 
+        groups = list(times.order_by().values('user', 'activity', 'activity__time_factor',
+            'billed_rate', 'billed_time_factor').annotate(hours_sum=models.Sum('hours')))
+        if not groups:
+            return 0
+        rates = ActivityOptions.get_rate_table(
+            users=set(item['user'] for item in groups),
+            activities=set(item['activity'] for item in groups))
         cost_sum = 0
-        # for each activity:
-        for item in distinct_activities:
-            activity = Activity.objects.get(pk=item['activity'])
-            hours_sum_per_user = times.filter(activity=activity).values('user').annotate(models.Sum('hours'))
-            # sum hours per user and multiply by user's rate for activity 
-            for hours_sum in hours_sum_per_user:
-                cost = Clock.calc_cost(hours_sum['user'], activity, hours_sum['hours__sum'])
-                if cost:
-                    cost_sum += cost
-            
-            # sum hours and multiply by rate for activity (replaced since users can now have individual rates)
-            # hours_sum = times.filter(activity=activity).aggregate(models.Sum('hours'))['hours__sum']
-            # rate = activity.get_rate()
-            # if rate:
-            #    cost_sum += hours_sum * float(activity.time_factor) * float(rate)
-
+        for item in groups:
+            rate = item['billed_rate']
+            if rate is None:
+                rate = rates.get_rate(item['user'], item['activity'])
+            if rate is None:
+                continue
+            time_factor = item['billed_time_factor']
+            if time_factor is None:
+                time_factor = item['activity__time_factor']
+            cost = Clock.calc_cost(item['user'], None, item['hours_sum'], rate, time_factor)
+            if cost:
+                cost_sum += cost
         return cost_sum
 
+    @staticmethod
+    @instrumented('bill_entries')
+    def bill_entries(qs, bill, batch_size=500):
+        """
+        Assigns the entries of the QuerySet that weren't billed yet to the bill,
+        freezing their rates and time factors, and saves the bill unless it was
+        saved before. This happens in one transaction that locks the entries, so
+        that concurrent requests can't bill them twice. Rates are resolved in a 
+        single query, and entries sharing rate and time factor are updated with
+        one statement per `batch_size` entries.
+
+        Returns a dictionary with the numbers of billed and skipped entries and 
+        the hours and cost billed. Nothing is saved if there are no unbilled
+        entries.
+        """
+        totals = {'entries': 0, 'skipped': 0, 'hours': 0, 'cost': 0}
+        with transaction.commit_on_success():
+            entries = list(qs.select_for_update().order_by().values_list('pk', 'project', 'user', 'activity', 
+                'start', 'hours', 'billed_rate', 'billed_time_factor', 'bill'))
+            unbilled = [entry for entry in entries if entry[-1] is None]
+            totals['skipped'] = len(entries) - len(unbilled)
+            if not unbilled:
+                return totals
+            if bill.pk is None:
+                bill.save()
+            user_ids = set(entry[2] for entry in unbilled)
+            activity_ids = set(entry[3] for entry in unbilled)
+            rates = ActivityOptions.get_rate_table(users=user_ids, activities=activity_ids)
+            time_factors = dict(Activity.objects.filter(pk__in=activity_ids).values_list('pk', 'time_factor'))
+            updates = {}
+            old_states = []
+            new_states = []
+            dates_per_user = {}
+            for pk, project_id, user_id, activity_id, start, hours, billed_rate, billed_time_factor, bill_id in unbilled:
+                old_states.append((project_id, user_id, activity_id, hours, billed_rate, billed_time_factor))
+                values = {}
+                # like Clock.get_rate(), rates that are not defined are billed as 0
+                if billed_rate is None:
+                    billed_rate = values['billed_rate'] = rates.get_rate(user_id, activity_id) or 0
+                if billed_time_factor is None:
+                    billed_time_factor = values['billed_time_factor'] = time_factors[activity_id]
+                new_states.append((project_id, user_id, activity_id, hours, billed_rate, billed_time_factor))
+                updates.setdefault(tuple(sorted(values.items())), []).append(pk)
+                dates_per_user.setdefault(user_id, set()).add(Clock.local_date(start))
+                totals['entries'] += 1
+                if hours:
+                    totals['hours'] += hours
+                    totals['cost'] += hours * float(billed_time_factor) * float(billed_rate)
+            for values, pks in updates.items():
+                for i in range(0, len(pks), batch_size):
+                    Clock.objects.filter(pk__in=pks[i:i + batch_size]).update(bill=bill, **dict(values))
+            # keep daily totals and budget snapshots up to date, which the 
+            # signals of Clock.save() would do
+            for user_id, dates in dates_per_user.items():
+                clock_entries_changed.send(sender=Clock, user_id=user_id, dates=dates)
+            ProjectBudgetSnapshot.apply_changes(old_states, new_states)
+        return totals
+
     @staticmethod
     def calc_cost(user, activity, hours_sum, billed_rate=None, billed_time_factor=None):
         if not hours_sum:
@@ -441,24 +929,106 @@ class Clock(models.Model):
             return hours_sum * float(billed_time_factor) * float(billed_rate)
 
     @staticmethod
+    @instrumented('sum_breaks')
     def sum_breaks(qs, from_date, to_date):
-        times = Clock.filter_between(qs, from_date, to_date).order_by('start')
-        seconds = 0
-        i = len(times) - 1
-        while i > 0:
-            if times[i-1].end:
-                seconds += (times[i].start - times[i-1].end).seconds
-            i -= 1
-        return seconds / 3600.0
+        times = Clock.filter_between(qs, from_date, to_date)
+        return sum(Clock.get_breaks(times).values(), 0)
+
+    # SQL returning the seconds between two datetime columns, per database vendor
+    SECONDS_BETWEEN_SQL = {
+        'postgresql': 'EXTRACT(EPOCH FROM (%(end)s - %(start)s))',
+        'sqlite': '(julianday(%(end)s) - julianday(%(start)s)) * 86400.0',
+        'oracle': '(CAST(%(end)s AS DATE) - CAST(%(start)s AS DATE)) * 86400',
+    }
+
+    @staticmethod
+    def supports_window_functions(connection):
+        if connection.vendor == 'sqlite':
+            import sqlite3
+            return sqlite3.sqlite_version_info >= (3, 25, 0)
+        return connection.vendor in Clock.SECONDS_BETWEEN_SQL
 
     @staticmethod
+    def get_breaks(qs):
+        """
+        Returns a dictionary mapping dates to the hours of breaks on that day, 
+        i.e. the time between the end of an entry and the start of the same 
+        user's next entry on the same day. 
+        """
+        connection = connections[qs.db]
+        if Clock.supports_window_functions(connection):
+            gaps = Clock._get_gaps_sql(qs, connection)
+        else:
+            gaps = Clock._get_gaps(qs)
+        breaks = {}
+        for previous_start, start, seconds in gaps:
+            date = Clock.local_date(start)
+            if seconds > 0 and Clock.local_date(previous_start) == date:
+                breaks[date] = breaks.get(date, 0) + seconds / 3600.0
+        return breaks
+
+    @staticmethod
+    def _get_gaps_sql(qs, connection):
+        """
+        Yields the start of the previous entry, the start of each entry and the 
+        seconds since the previous entry ended, computed with a window function.
+        """
+        condition = Clock.pk_in_sql(qs)
+        if condition is None:
+            return
+        where, params = condition
+        qn = connection.ops.quote_name
+        window = 'OVER (PARTITION BY %s ORDER BY %s)' % (
+            qn(Clock._meta.get_field('user').column), qn(Clock._meta.get_field('start').column))
+        sql = 'SELECT previous_start, start, seconds FROM (' \
+            'SELECT LAG(%(start)s) %(window)s AS previous_start, %(start)s AS start, %(seconds)s AS seconds ' \
+            'FROM %(clock)s WHERE %(where)s) gaps WHERE seconds > 0' % {
+                'clock': qn(Clock._meta.db_table),
+                'start': qn(Clock._meta.get_field('start').column),
+                'window': window,
+                'seconds': Clock.SECONDS_BETWEEN_SQL[connection.vendor] % {
+                    'start': 'LAG(%s) %s' % (qn(Clock._meta.get_field('end').column), window),
+                    'end': qn(Clock._meta.get_field('start').column),
+                },
+                'where': where,
+            }
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        for previous_start, start, seconds in cursor.fetchall():
+            # rounded to milliseconds, since some databases compute differences in fractions of days
+            yield Clock.typecast_datetime(previous_start), Clock.typecast_datetime(start), round(seconds, 3)
+
+    @staticmethod
+    def _get_gaps(qs):
+        """
+        Same as _get_gaps_sql(), for databases without window functions.
+        """
+        previous = None
+        for user_id, start, end in qs.order_by('user', 'start').values_list('user', 'start', 'end').iterator():
+            if previous is not None and previous[0] == user_id and previous[2] is not None:
+                yield previous[1], start, (start - previous[2]).total_seconds()
+            previous = (user_id, start, end)
+
+    @staticmethod
+    def typecast_datetime(value):
+        """
+        Converts datetimes returned by raw queries, which some database 
+        backends return as strings, and which may lack time zone info.
+        """
+        if isinstance(value, basestring):
+            value = typecast_timestamp(value)
+        if value is not None and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+        return value
+
+    @staticmethod
+    @instrumented('count_days')
     def count_days(qs, from_date, to_date):
         times = Clock.filter_between(qs, from_date, to_date)
-        # This is not working since aggregation does not work with extra() fields:
-        #     from django.db.models import Count
-        #     return times.extra(select={'date_only': "DATE(start)"}).aggregate(Count('start_date', distinct=True))['date_only__count']
-        # However, this is much simpler anyway:
-        return times.dates('start', 'day').count()
+        # dates() returns UTC dates, whereas days are counted in the default
+        # time zone, like the daily totals are
+        return len(set(Clock.local_date(start) for start in 
+            times.order_by().values_list('start', flat=True).iterator()))
 
     @staticmethod
     def start_of_week(date):
@@ -473,9 +1043,173 @@ class Clock(models.Model):
     @staticmethod
     def start_of_day(date):
         return timezone.make_aware(datetime.datetime(date.year, date.month, date.day), timezone.get_default_timezone())
+
+    @staticmethod
+    def local_date(value):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value, timezone.get_default_timezone())
+        return value.date()
     
     @staticmethod
-    def summarize(user, qs):
+    @instrumented('summarize')
+    def summarize(user, qs, rollup_filter=None):
+        """
+        Returns the summary of the entries of `qs` for the user (see 
+        _summarize()). Summaries are cached per user, filters of `qs` and day
+        until entries or options they depend on change (see 
+        get_summary_dependencies()). The hours of a running entry are brought 
+        up to date when summaries are read from the cache.
+        """
+        signature = Clock.get_filter_signature(qs)
+        summary = Clock.get_cached_summary(user, signature)
+        if summary is not None:
+            with instrument('summary_cache_hit'):
+                summary_cache_stats['hits'] += 1
+            return summary
+        with instrument('summary_cache_miss'):
+            summary_cache_stats['misses'] += 1
+            # versions are read first, so that changes while summarizing 
+            # invalidate the summary
+            versions = Clock.get_summary_versions(Clock.get_summary_dependencies(user, rollup_filter))
+            computed = timezone.now()
+            summary = Clock._summarize(user, qs, rollup_filter)
+            clocked_in_time = Clock.clocked_in_time(user)
+            get_summary_cache().set(Clock.SUMMARY_CACHE_KEY % (user.pk, signature, Clock.local_date(computed)), {
+                'versions': versions,
+                'computed': computed,
+                'clocked_in_time_id': clocked_in_time and clocked_in_time.pk,
+                'summary': dict(summary, projects=list(summary['projects'].values_list('pk', flat=True))),
+            }, SUMMARY_CACHE_TIMEOUT)
+        return summary
+
+    @staticmethod
+    def get_cached_summary(user, signature):
+        """
+        Returns the cached summary of the user with the given filter signature,
+        or None if it isn't cached or entries or options changed since.
+        """
+        now = timezone.now()
+        cached = get_summary_cache().get(Clock.SUMMARY_CACHE_KEY % (user.pk, signature, Clock.local_date(now)))
+        if cached is None or Clock.get_summary_versions(cached['versions'].keys()) != cached['versions']:
+            return None
+        clocked_in_time = Clock.clocked_in_time(user)
+        if cached['clocked_in_time_id'] != (clocked_in_time and clocked_in_time.pk):
+            return None
+
+        summary = cached['summary']
+        hours = dict(summary['hours'])
+        dates = dict(summary['dates'], today=timezone.make_aware(datetime.datetime.today(), timezone.get_default_timezone()))
+        if hours['counting']:
+            # the running entry is part of the totals, so the closing times 
+            # don't change while it runs
+            counting = Clock.hours_between(clocked_in_time.start, now)
+            for name in ('actual', 'today', 'balance', 'balance_until_weekend'):
+                hours[name] += counting - hours['counting']
+            hours['counting'] = counting
+            dates['to'] = now
+        else:
+            hours['closing'] = dict((name, closing + (now - cached['computed'])) 
+                for name, closing in hours['closing'].items())
+        days_actual = summary['days']['actual']
+        hours['average_daily'] = hours['actual'] / float(days_actual) if days_actual != 0 else 0
+        return dict(summary, hours=hours, dates=dates, 
+            projects=Project.objects.filter(pk__in=summary['projects']))
+
+    @staticmethod
+    def get_summary_dependencies(user, rollup_filter=None):
+        """
+        Returns the keys of the versions of the entries and options a summary
+        of the user depends on. These are the entries of the user of 
+        `rollup_filter` and of the summarized user, if the filter selects a 
+        single user, in the months of its date range, if it has one; otherwise
+        all entries of all users.
+        """
+        keys = [Clock.SUMMARY_VERSION_KEY % ('options', user.pk, 'all'),
+            Clock.SUMMARY_VERSION_KEY % ('options', 'all', 'all')]
+        user_ids = set(str(getattr(rollup_filter[key], 'pk', rollup_filter[key]))
+            for key in ('user', 'user__id__exact') if key in (rollup_filter or {}))
+        months = None
+        if len(user_ids) == 1:
+            user_ids.add(str(user.pk))
+            date_range = ClockBalance.get_date_range(rollup_filter)
+            if date_range and date_range[1] and date_range[2]:
+                months = Clock.get_months(date_range[1], date_range[2] - datetime.timedelta(days=1))
+        else:
+            user_ids = ['all']
+        if months is None or len(months) > SUMMARY_CACHE_MAX_MONTHS:
+            months = ['all']
+        for user_id in user_ids:
+            keys.extend(Clock.SUMMARY_VERSION_KEY % ('entries', user_id, month) for month in months)
+        return keys
+
+    @staticmethod
+    def get_months(start, end):
+        """
+        Returns the months from the date `start` to `end` as `YYYY-MM`.
+        """
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append('%04i-%02i' % (year, month))
+            year, month = year + month / 12, month % 12 + 1
+        return months
+
+    @staticmethod
+    def get_summary_versions(keys):
+        """
+        Returns the current versions of the given keys. Versions are random, so
+        that versions that were evicted from the cache don't come back.
+        """
+        cache = get_cache()
+        versions = cache.get_many(keys)
+        missing = dict((key, uuid.uuid4().hex) for key in keys if key not in versions)
+        if missing:
+            cache.set_many(missing, Clock.get_summary_version_timeout())
+            versions.update(missing)
+        return versions
+
+    @staticmethod
+    def forget_summaries(keys):
+        """
+        Invalidates all cached summaries depending on the version keys.
+        """
+        get_cache().set_many(dict((key, uuid.uuid4().hex) for key in keys), Clock.get_summary_version_timeout())
+
+    @staticmethod
+    def get_summary_version_timeout():
+        """
+        Returns the seconds versions are cached. If the cache isn't shared by
+        the processes of the server, changes in one of them don't invalidate 
+        the summaries of the others, so versions expire after 
+        SUMMARY_VERSION_LOCAL_TIMEOUT seconds.
+        """
+        return SUMMARY_VERSION_LOCAL_TIMEOUT if is_process_local() else SUMMARY_CACHE_TIMEOUT
+
+    @staticmethod
+    def forget_summaries_of_entries(user_id, dates):
+        keys = [Clock.SUMMARY_VERSION_KEY % ('entries', user_id, 'all'), 
+            Clock.SUMMARY_VERSION_KEY % ('entries', 'all', 'all')]
+        keys.extend(Clock.SUMMARY_VERSION_KEY % ('entries', user_id, month) 
+            for month in set('%04i-%02i' % (date.year, date.month) for date in dates))
+        Clock.forget_summaries(keys)
+
+    @staticmethod
+    def forget_summaries_of_options(user_id=None):
+        Clock.forget_summaries([Clock.SUMMARY_VERSION_KEY % ('options', user_id or 'all', 'all')])
+
+    @staticmethod
+    def forget_all_summaries():
+        # all summaries depend on the default options
+        Clock.forget_summaries_of_options()
+
+    @staticmethod
+    def _summarize(user, qs, rollup_filter=None):
+        """
+        If `rollup_filter` is passed, it must contain ClockDay lookups that are
+        equivalent to the filters applied to `qs`. Totals of past days are then
+        read from the running or daily totals, and only today's entries are 
+        aggregated.
+        """
         # TODO: Meaning of summary is unclear to superuser (i.e. if multiple usersa are displayed)
         from django.db.models import Min, Max
         times = qs.filter(user=user)
@@ -484,15 +1218,21 @@ class Clock(models.Model):
         to_start = summary['to_start']
         to_end = summary['to_end']
         clock_options = ClockOptions.get_for_user(user)
+        today = Clock.start_of_day(timezone.make_aware(datetime.datetime.today(), timezone.get_default_timezone()))
         
         if not from_start or not to_start or not to_end:
             working_days = working_days_week = days_actual = hours_actual = hours_today = break_today = projected_break = 0
         else:
-            working_days = Clock.sum_working_days(from_start, to_start)
-            working_days_week = Clock.sum_working_days(Clock.start_of_week(from_start), Clock.end_of_week(to_start))
-            days_actual = Clock.count_days(qs, from_start, max(to_start, to_end))
-            hours_actual = Clock.sum_hours(qs, from_start, max(to_start, to_end))
-            today = Clock.start_of_day(timezone.make_aware(datetime.datetime.today(), timezone.get_default_timezone()))
+            working_days = Clock.sum_working_days(from_start, to_start, clock_options)
+            working_days_week = Clock.sum_working_days(Clock.start_of_week(from_start), Clock.end_of_week(to_start), clock_options)
+            if rollup_filter is None:
+                days_actual = Clock.count_days(qs, from_start, max(to_start, to_end))
+                hours_actual = Clock.sum_hours(qs, from_start, max(to_start, to_end))
+            else:
+                closed = ClockBalance.sum_closed(today.date(), **rollup_filter)  \
+                    or ClockDay.sum_closed(today.date(), **rollup_filter)
+                days_actual = closed['days'] + Clock.count_days(qs, today, None)
+                hours_actual = closed['hours_credited'] + Clock.sum_hours(qs, today)
             hours_today = Clock.sum_hours(qs, today, today + timezone.timedelta(days=1)) or 0
             break_today = Clock.sum_breaks(qs, today, today + timezone.timedelta(days=1))
             if not break_today: 
@@ -544,23 +1284,240 @@ class Clock(models.Model):
         }
         
         if 'billing' in settings.INSTALLED_APPS:
+            if rollup_filter is None:
+                cost_total = Clock.sum_cost(times)
+            else:
+                rollup_filter = dict(rollup_filter, user=user)
+                cost_total = ClockDay.sum_closed(today.date(), **rollup_filter)['cost']  \
+                    + Clock.sum_cost(times, today)
             summary.update({
                 'cost': {
-                    'total': Clock.sum_cost(times),
+                    'total': cost_total,
                     'unbilled': Clock.sum_cost(times.filter(bill=None))
                 },
             })
         return summary
         
-    def get_rate(self):
+    @staticmethod
+    def get_live_baseline(user, today):
+        """
+        Returns the hours of the closed entries of the user on the day starting 
+        at `today` and the breaks between them, along with the options of the 
+        user. The result is cached until an entry of the user on that day or 
+        the options of the user, the default options or holidays change, but
+        LIVE_BASELINE_TIMEOUT seconds at most.
+        """
+        key = Clock.get_live_baseline_key(user.pk, today.date())
+        baseline = get_cache().get(key)
+        if baseline is None:
+            times = Clock.objects.filter(user=user)
+            tomorrow = today + timezone.timedelta(days=1)
+            clock_options = ClockOptions.get_for_user(user)
+            baseline = {
+                'hours_today': Clock.sum_hours(times, today, tomorrow) or 0,
+                'break_today': Clock.sum_breaks(times, today, tomorrow),
+                'hours_per_day': clock_options.hours_per_day,
+                'unpaid_break': clock_options.unpaid_break,
+            }
+            get_cache().set(key, baseline, LIVE_BASELINE_TIMEOUT)
+        return baseline
+
+    @staticmethod
+    def get_live_baseline_key(user_id, date):
+        # changes of the default options or holidays, which invalidate all
+        # summaries, invalidate all baselines as well
+        version_key = Clock.SUMMARY_VERSION_KEY % ('options', 'all', 'all')
+        version = Clock.get_summary_versions([version_key])[version_key]
+        return Clock.LIVE_BASELINE_CACHE_KEY % (user_id, date.isoformat(), version)
+
+    @staticmethod
+    def forget_live_baseline(user_id, dates):
+        get_cache().delete_many([Clock.get_live_baseline_key(user_id, date) for date in dates])
+
+    @staticmethod
+    @instrumented('live_status')
+    def live_status(user):
+        """
+        Returns the entry the user is clocked in with, the hours counting since
+        it started, today's total and the projected closing time, like 
+        summarize() does for today. Only reads the cache unless entries of the
+        user changed.
+        """
+        now = timezone.now()
+        today = Clock.start_of_day(timezone.make_aware(datetime.datetime.today(), timezone.get_default_timezone()))
+        baseline = Clock.get_live_baseline(user, today)
+        clocked_in_time = Clock.clocked_in_time(user)
+        if clocked_in_time is not None:
+            hours_counting = Clock.hours_between(clocked_in_time.start, now)
+        else:
+            hours_counting = 0
+        hours_today = baseline['hours_today'] + hours_counting
+        if baseline['break_today']:
+            projected_break = 0
+        else:
+            projected_break = baseline['unpaid_break']
+        if baseline['hours_per_day'] is not None:
+            closing = now - timezone.timedelta(hours=hours_today - baseline['hours_per_day']) + timezone.timedelta(hours=projected_break)
+        else:
+            closing = None
+        return {
+            'clocked_in_time': clocked_in_time,
+            'hours': {
+                'counting': hours_counting,
+                'today': hours_today,
+                'break_today': baseline['break_today'] or baseline['unpaid_break'],
+                'closing': closing,
+            },
+        }
+
+    @staticmethod
+    def get_filter_signature(qs):
+        """
+        Returns a hash of the SQL and parameters of `qs`, which identifies 
+        its filters.
+        """
+        try:
+            sql, params = qs.query.sql_with_params()
+        except EmptyResultSet:
+            sql, params = '', ()
+        return hashlib.md5(force_bytes(sql) + force_bytes(repr(params))).hexdigest()
+
+    @staticmethod
+    def live_summary(user, signature):
+        """
+        Returns the totals and the regular closing time of the cached summary 
+        of the user with the given filter signature, brought up to date, or 
+        None if it isn't cached or outdated.
+        """
+        summary = Clock.get_cached_summary(user, signature)
+        if summary is None:
+            return None
+        hours = summary['hours']
+        live_summary = dict((name, hours[name]) 
+            for name in ('actual', 'today', 'balance', 'balance_until_weekend'))
+        live_summary['closing'] = hours['closing']['regular']
+        return live_summary
+
+    @staticmethod
+    @instrumented('summarize_team')
+    def summarize_team(users, from_date, to_date):
+        """
+        Returns summaries of the given users from `from_date` to `to_date` 
+        (inclusive), in the order of the users. Past days are read from the 
+        daily totals of all users in one grouped query, today's entries in one
+        more query, and options and holidays in one query each, regardless of 
+        the number of users. Target hours count the working days up to today.
+        """
+        users = list(users)
+        index = dict((user.pk, i) for i, user in enumerate(users))
+        count = len(users)
+        now = timezone.now()
+        today = Clock.local_date(now)
+        # one array per figure, indexed like the users
+        hours_actual = [0.0] * count
+        days_actual = [0] * count
+        break_seconds = [0.0] * count
+        hours_today = [0.0] * count
+        hours_counting = [0.0] * count
+
+        days = ClockDay.objects.filter(user__in=index.keys(), date__gte=from_date, 
+            date__lte=min(to_date, today - datetime.timedelta(days=1))).order_by(
+            ).values('user', 'date').annotate(hours_credited_sum=models.Sum('hours_credited'), 
+            break_seconds_sum=models.Sum('break_seconds'))
+        for day in days:
+            i = index[day['user']]
+            hours_actual[i] += day['hours_credited_sum']
+            days_actual[i] += 1
+            break_seconds[i] += day['break_seconds_sum']
+
+        if from_date <= today <= to_date:
+            start = Clock.start_of_day(today)
+            entries = Clock.objects.filter(user__in=index.keys(), start__gte=start, 
+                start__lt=start + timezone.timedelta(days=1)).order_by('user', 'start').values_list(
+                'user', 'start', 'end', 'hours', 'activity__time_factor')
+            previous_user_id = previous_end = None
+            for user_id, start, end, hours, time_factor in entries:
+                i = index[user_id]
+                if previous_user_id != user_id:
+                    days_actual[i] += 1
+                elif previous_end and start > previous_end:
+                    break_seconds[i] += (start - previous_end).total_seconds()
+                if hours is not None:
+                    hours_today[i] += hours * time_factor
+                elif end is None:
+                    # clocked in: add hours until now, like summarize() does
+                    hours_counting[i] += Clock.hours_between(start, now)
+                previous_user_id, previous_end = user_id, end
+            hours_today = [a + b for a, b in zip(hours_today, hours_counting)]
+            hours_actual = [a + b for a, b in zip(hours_actual, hours_today)]
+
+        options = list(ClockOptions.objects.filter(Q(user__in=index.keys()) | Q(user=None)))
+        target_end = min(to_date, today)
+        holidays = list(Holiday.get_dates(from_date, target_end))
+        summaries = []
+        for i, user in enumerate(users):
+            clock_options = ClockOptions.select_for_user(options, user)
+            working_days = clock_options.count_working_days(from_date, target_end, holidays)
+            hours_target = working_days * clock_options.hours_per_day
+            summaries.append({
+                'user': user,
+                'clock_options': clock_options,
+                'hours': {
+                    'balance': hours_actual[i] - hours_target,
+                    'target': hours_target,
+                    'actual': hours_actual[i],
+                    'today': hours_today[i],
+                    'counting': hours_counting[i],
+                    'average_daily': hours_actual[i] / days_actual[i] if days_actual[i] else 0,
+                    'breaks': break_seconds[i] / 3600,
+                    'average_break': break_seconds[i] / 3600 / days_actual[i] if days_actual[i] else 0,
+                },
+                'days': {
+                    'target': working_days,
+                    'actual': days_actual[i],
+                },
+            })
+        return summaries
+
+    @staticmethod
+    def resolve_rates(entries):
+        """
+        Looks up the rates of all `entries` with one query and attaches them 
+        to the entries, so that get_rate() and get_cost() don't query them 
+        one by one. Returns the entries as a list.
+        """
+        entries = list(entries)
+        rates = ActivityOptions.get_rate_table(
+            set(entry.user_id for entry in entries if not entry.billed_rate), 
+            set(entry.activity_id for entry in entries if not entry.billed_rate))
+        for entry in entries:
+            entry._rates = rates
+        return entries
+
+    def get_rate(self, rates=None):
+        """
+        Rates are looked up in the RateTable `rates` if passed, or in the 
+        one attached by resolve_rates().
+        """
         if self.billed_rate:
             return self.billed_rate
+        if rates is None:
+            rates = getattr(self, '_rates', None)
+        if rates is not None:
+            return rates.get_rate(self.user_id, self.activity_id)
         return self.activity.get_rate(for_user=self.user)
     get_rate.short_description = _('rate')
 
-    def get_cost(self):
-        return Clock.calc_cost(self.user, self.activity, self.hours, 
-            self.billed_rate, self.billed_time_factor)
+    def get_cost(self, rates=None):
+        if rates is None:
+            rates = getattr(self, '_rates', None)
+        billed_rate = self.billed_rate
+        if billed_rate is None and rates is not None:
+            billed_rate = rates.get_rate(self.user_id, self.activity_id)
+            if billed_rate is None:
+                return None
+        return Clock.calc_cost(self.user_id, self.activity, self.hours, 
+            billed_rate, self.billed_time_factor)
     get_cost.short_description = _('cost')
         
     def hours_rounded(self):
@@ -600,30 +1557,45 @@ class Clock(models.Model):
     status_icon.short_description = ''
     status_icon.allow_tags = True
 
+    def _format(self, formatter, value, format):
+        """
+        Memoizes formatted dates and times, since they are displayed several 
+        times per entry, e.g. by end_time() and __unicode__().
+        """
+        key = (formatter, value, format)
+        try:
+            return self._formatted[key]
+        except AttributeError:
+            self._formatted = {}
+        except KeyError:
+            pass
+        self._formatted[key] = formatted = formatter(value, format)
+        return formatted
+
     def weekday(self):
-        return format_date(self.start, WEEKDAY_FORMAT)
+        return self._format(format_date, self.start, WEEKDAY_FORMAT)
     weekday.short_description = _('day')
         
     def start_date(self):
-        return format_date(self.start, DATE_FORMAT)
+        return self._format(format_date, self.start, DATE_FORMAT)
     start_date.short_description = _('date')
     start_date.admin_order_field = 'start'
 
     def end_date(self):
-        return format_date(self.end, DATE_FORMAT)
+        return self._format(format_date, self.end, DATE_FORMAT)
     end_date.short_description = _('end date')
     end_date.admin_order_field = 'end'
 
     def start_time(self):
-        return format_time(self.start, TIME_FORMAT)
+        return self._format(format_time, self.start, TIME_FORMAT)
     start_time.short_description = _('start')
 
     def end_time(self):
         if self.end != None:
             if self.start_date() == self.end_date():
-                return format_time(self.end, TIME_FORMAT)
+                return self._format(format_time, self.end, TIME_FORMAT)
             else:
-                return '%(time)s (%(date)s)' % {'time': format_time(self.end, TIME_FORMAT), 'date': self.end_date()}
+                return '%(time)s (%(date)s)' % {'time': self._format(format_time, self.end, TIME_FORMAT), 'date': self.end_date()}
         else:
             return ''
     end_time.short_description = _('end')
@@ -635,4 +1607,521 @@ class Clock(models.Model):
             'to_time': self.end_time(),
         }
 
-        return result
\ No newline at end of file
+        return result
+
+
+class ClockDay(models.Model):
+    """
+    Daily totals of the clock entries per user and activity. They are updated
+    whenever entries are saved or deleted, so that summaries do not have to 
+    aggregate all entries of past days again.
+    """
+
+    user = models.ForeignKey(User, verbose_name=_('user'))
+    date = models.DateField(_('date'))
+    activity = models.ForeignKey(Activity, verbose_name=_('activity'))
+    entries = models.PositiveIntegerField(_('entries'), default=0)
+    hours = models.FloatField(_('hours'), default=0)
+    hours_credited = models.FloatField(_('credited hours'), default=0)
+    cost = models.FloatField(_('cost'), null=True, blank=True)
+    first_start = models.DateTimeField(_('first start'))
+    last_end = models.DateTimeField(_('last end'), null=True, blank=True)
+    # breaks preceding the entries of this activity, in seconds
+    break_seconds = models.FloatField(_('break'), default=0)
+
+    class Meta:
+        ordering = ['user', 'date']
+        unique_together = (('user', 'date', 'activity'),)
+        verbose_name = _('daily total')
+        verbose_name_plural = _('daily totals')
+
+    def __unicode__(self):
+        return u'%s %s' % (format_date(self.date, DATE_FORMAT), self.activity_id)
+
+    @staticmethod
+    def get_state(entry):
+        """
+        Returns the values of an entry the daily totals of its day depend on.
+        """
+        return (entry.user_id, entry.start, entry.end, entry.activity_id, entry.hours)
+
+    @staticmethod
+    def compute(entries, rates):
+        """
+        Returns unsaved ClockDay instances for the given entries, which need 
+        to be ordered by user and start. 
+        """
+        days = {}
+        previous = None
+        for entry in entries:
+            date = Clock.local_date(entry.start)
+            key = (entry.user_id, date, entry.activity_id)
+            day = days.get(key)
+            if day is None:
+                day = days[key] = ClockDay(user_id=entry.user_id, date=date, 
+                    activity_id=entry.activity_id, first_start=entry.start)
+            day.entries += 1
+            if entry.hours is not None:
+                day.hours += entry.hours
+                day.hours_credited += entry.hours * entry.activity.time_factor
+                cost = entry.get_cost(rates)
+                if cost:
+                    day.cost = (day.cost or 0) + cost
+            if entry.end and (day.last_end is None or entry.end > day.last_end):
+                day.last_end = entry.end
+            if previous is not None and previous.user_id == entry.user_id and previous.end  \
+                and Clock.local_date(previous.start) == date:
+                    day.break_seconds += max(0, (entry.start - previous.end).total_seconds())
+            previous = entry
+        return days.values()
+
+    @staticmethod
+    def refresh(user, dates):
+        """
+        Recomputes the totals of the given dates for a user.
+        """
+        dates = set(dates)
+        if not dates:
+            return
+        user_id = getattr(user, 'pk', user)
+        ranges = Q()
+        for date in dates:
+            start = Clock.start_of_day(date)
+            ranges |= Q(start__gte=start, start__lt=start + timezone.timedelta(days=1))
+        entries = list(Clock.objects.filter(ranges, user=user_id).select_related('activity').order_by('start'))
+        rates = ActivityOptions.get_rate_table(users=[user_id], 
+            activities=set(entry.activity_id for entry in entries))
+        ClockDay.objects.filter(user=user_id, date__in=dates).delete()
+        ClockDay.objects.bulk_create(ClockDay.compute(entries, rates))
+        ClockBalance.refresh(user_id, dates)
+
+    @staticmethod
+    def refresh_activity(activity, user=None):
+        """
+        Recomputes all totals of an activity, e.g. after its rates changed.
+        """
+        days = ClockDay.objects.filter(activity=activity)
+        if user:
+            days = days.filter(user=user)
+        dates_per_user = {}
+        for user_id, date in days.values_list('user', 'date').distinct():
+            dates_per_user.setdefault(user_id, set()).add(date)
+        for user_id, dates in dates_per_user.items():
+            ClockDay.refresh(user_id, dates)
+
+    @staticmethod
+    def rebuild(users=None):
+        """
+        Recomputes all totals, or those of the given users.
+        """
+        if users is None:
+            user_ids = Clock.objects.order_by().values_list('user', flat=True).distinct()
+            ClockDay.objects.all().delete()
+        else:
+            user_ids = [getattr(user, 'pk', user) for user in users]
+            ClockDay.objects.filter(user__in=user_ids).delete()
+        rates = ActivityOptions.get_rate_table()
+        for user_id in list(user_ids):
+            entries = Clock.objects.filter(user=user_id).select_related('activity').order_by('start')
+            ClockDay.objects.bulk_create(ClockDay.compute(entries.iterator(), rates))
+        ClockBalance.rebuild(users)
+        # entries were probably changed without sending clock_entries_changed
+        Clock.forget_all_summaries()
+
+    @staticmethod
+    @instrumented('sum_closed')
+    def sum_closed(before, **lookups):
+        """
+        Returns hours, credited hours, cost and number of days of all totals 
+        before the given date that match the lookups.
+        """
+        totals = ClockDay.objects.filter(**lookups).filter(date__lt=before).aggregate(
+            hours=models.Sum('hours'), hours_credited=models.Sum('hours_credited'), 
+            cost=models.Sum('cost'), days=models.Count('date', distinct=True))
+        for key in totals:
+            totals[key] = totals[key] or 0
+        return totals
+
+
+class ClockBalance(models.Model):
+    """
+    Running totals of the credited hours and of the days with entries per user,
+    up to and including each day with entries. They are updated along with the
+    daily totals, so that the totals of any range of days are the difference 
+    of two running totals, regardless of the length of the history.
+    """
+
+    user = models.ForeignKey(User, verbose_name=_('user'))
+    date = models.DateField(_('date'))
+    hours_credited = models.FloatField(_('credited hours'), default=0)
+    hours_credited_total = models.FloatField(_('credited hours total'), default=0)
+    days_total = models.PositiveIntegerField(_('days total'), default=0)
+
+    class Meta:
+        ordering = ['user', 'date']
+        unique_together = (('user', 'date'),)
+        verbose_name = _('running total')
+        verbose_name_plural = _('running totals')
+
+    def __unicode__(self):
+        return u'%s %s' % (format_date(self.date, DATE_FORMAT), self.hours_credited_total)
+
+    @staticmethod
+    def get_totals(user, before):
+        """
+        Returns the credited hours and the number of days with entries of the 
+        user before the given date.
+        """
+        totals = ClockBalance.objects.filter(user=user, date__lt=before).order_by('-date'
+            ).values_list('hours_credited_total', 'days_total')[:1]
+        return totals[0] if totals else (0, 0)
+
+    @staticmethod
+    def refresh(user, dates):
+        """
+        Updates the running totals after the daily totals of the given dates
+        were recomputed for a user, shifting the running totals of all later
+        days by the difference.
+        """
+        user_id = getattr(user, 'pk', user)
+        days = dict(ClockDay.objects.filter(user=user_id, date__in=dates).order_by(
+            ).values_list('date').annotate(models.Sum('hours_credited')))
+        for date in sorted(set(dates)):
+            hours = days.get(date)
+            try:
+                balance = ClockBalance.objects.get(user=user_id, date=date)
+            except ClockBalance.DoesNotExist:
+                balance = None
+            hours_delta = (hours or 0) - (balance.hours_credited if balance else 0)
+            days_delta = (hours is not None) - (balance is not None)
+            later = ClockBalance.objects.filter(user=user_id, date__gt=date)
+            if hours is None:
+                if balance:
+                    balance.delete()
+            elif balance:
+                if hours == balance.hours_credited:
+                    continue
+                later = ClockBalance.objects.filter(user=user_id, date__gte=date)
+                ClockBalance.objects.filter(pk=balance.pk).update(hours_credited=hours)
+            else:
+                hours_credited_total, days_total = ClockBalance.get_totals(user_id, date)
+                ClockBalance.objects.create(user_id=user_id, date=date, hours_credited=hours,
+                    hours_credited_total=hours_credited_total + hours, days_total=days_total + 1)
+            if hours_delta or days_delta:
+                later.update(hours_credited_total=models.F('hours_credited_total') + hours_delta,
+                    days_total=models.F('days_total') + days_delta)
+
+    @staticmethod
+    def rebuild(users=None):
+        """
+        Recomputes all running totals from the daily totals, or those of the 
+        given users.
+        """
+        days = ClockDay.objects.all()
+        if users is None:
+            ClockBalance.objects.all().delete()
+        else:
+            users = [getattr(user, 'pk', user) for user in users]
+            ClockBalance.objects.filter(user__in=users).delete()
+            days = days.filter(user__in=users)
+        balances = []
+        previous = None
+        for user_id, date, hours in days.order_by('user', 'date').values_list(
+            'user', 'date').annotate(models.Sum('hours_credited')).iterator():
+                balance = ClockBalance(user_id=user_id, date=date, hours_credited=hours,
+                    hours_credited_total=hours, days_total=1)
+                if previous is not None and previous.user_id == user_id:
+                    balance.hours_credited_total += previous.hours_credited_total
+                    balance.days_total += previous.days_total
+                balances.append(balance)
+                previous = balance
+        ClockBalance.objects.bulk_create(balances)
+
+    @staticmethod
+    def get_date_range(lookups):
+        """
+        Returns the user pk and the first and the day after the last date of the
+        ClockDay lookups, or None if they can't be expressed like that.
+        """
+        user_ids = set(str(getattr(lookups[key], 'pk', lookups[key])) 
+            for key in ('user', 'user__id__exact') if key in lookups)
+        if len(user_ids) != 1:
+            return None
+        start = end = None
+        try:
+            values = dict((key, value if isinstance(value, datetime.date) else parse_date(value))
+                for key, value in lookups.items() if key in ('date__gte', 'date__lt'))
+            year, month, day = (int(lookups.get(key, 0)) for key in ('date__year', 'date__month', 'date__day'))
+            if (day and not month) or (month and not year):
+                return None
+            if year:
+                if day:
+                    start = datetime.date(year, month, day)
+                    end = start + datetime.timedelta(days=1)
+                elif month:
+                    start = datetime.date(year, month, 1)
+                    end = datetime.date(year + month / 12, month % 12 + 1, 1)
+                else:
+                    start = datetime.date(year, 1, 1)
+                    end = datetime.date(year + 1, 1, 1)
+        except (TypeError, ValueError):
+            return None
+        if None in values.values() or set(lookups) - set(['user', 'user__id__exact', 
+            'date__gte', 'date__lt', 'date__year', 'date__month', 'date__day']):
+                return None
+        if 'date__gte' in values:
+            start = max(start or values['date__gte'], values['date__gte'])
+        if 'date__lt' in values:
+            end = min(end or values['date__lt'], values['date__lt'])
+        return user_ids.pop(), start, end
+
+    @staticmethod
+    @instrumented('sum_balance')
+    def sum_closed(before, **lookups):
+        """
+        Returns credited hours and number of days with entries before the given 
+        date, like ClockDay.sum_closed() but with at most two lookups of running 
+        totals. Returns None unless the lookups select a single user and a range
+        of dates.
+        """
+        date_range = ClockBalance.get_date_range(lookups)
+        if date_range is None:
+            return None
+        user_id, start, end = date_range
+        end = min(end or before, before)
+        if start is not None and start >= end:
+            return {'hours_credited': 0, 'days': 0}
+        hours_credited, days = ClockBalance.get_totals(user_id, end)
+        if start is not None and days:
+            hours_before, days_before = ClockBalance.get_totals(user_id, start)
+            hours_credited -= hours_before
+            days -= days_before
+        return {'hours_credited': hours_credited, 'days': days}
+
+
+class ProjectBudgetSnapshot(models.Model):
+    """
+    Hours, cost, balance and coverage of a project. They are updated by the 
+    difference whenever entries of the project are saved or deleted, and marked
+    as stale when rates or time factors change, until they are refreshed.
+    """
+
+    project = models.OneToOneField(Project, verbose_name=_('project'), related_name='budget_snapshot')
+    hours = models.FloatField(_('hours spent'), default=0)
+    cost = models.FloatField(_('budget spent'), default=0)
+    balance = models.FloatField(_('balance'), null=True, blank=True)
+    coverage = models.FloatField(_('coverage'), null=True, blank=True)
+    stale = models.BooleanField(_('stale'), default=False)
+    updated = models.DateTimeField(_('updated'))
+
+    class Meta:
+        verbose_name = _('budget snapshot')
+        verbose_name_plural = _('budget snapshots')
+
+    def __unicode__(self):
+        return u'%s' % self.project_id
+
+    def update_balance(self, budget):
+        """
+        Sets balance and coverage like Project.balance() and coverage() do.
+        """
+        if budget > 0 and self.cost > 0:
+            self.balance = float(budget) - self.cost
+            self.coverage = self.balance / float(budget)
+        else:
+            self.balance = self.coverage = None
+
+    @staticmethod
+    def get_state(entry):
+        """
+        Returns the values of an entry the snapshot of its project depends on.
+        """
+        return (entry.project_id, entry.user_id, entry.activity_id, entry.hours, 
+            entry.billed_rate, entry.billed_time_factor)
+
+    @staticmethod
+    def apply_changes(removed, added):
+        """
+        Subtracts the hours and cost of entries in the `removed` states, adds 
+        those of the `added` ones (see get_state()), and updates balance and 
+        coverage of the projects involved. Missing snapshots are refreshed.
+        """
+        states = [(state, -1) for state in removed if state[0] and state[3]]  \
+            + [(state, 1) for state in added if state[0] and state[3]]
+        if not states:
+            return
+        user_ids = set(state[1] for state, sign in states)
+        activity_ids = set(state[2] for state, sign in states)
+        rates = ActivityOptions.get_rate_table(users=user_ids, activities=activity_ids)
+        time_factors = dict(Activity.objects.filter(pk__in=activity_ids).values_list('pk', 'time_factor'))
+        deltas = {}
+        for (project_id, user_id, activity_id, hours, billed_rate, billed_time_factor), sign in states:
+            delta = deltas.setdefault(project_id, [0, 0])
+            delta[0] += sign * hours * time_factors[activity_id]
+            if billed_rate is None:
+                billed_rate = rates.get_rate(user_id, activity_id)
+            if billed_time_factor is None:
+                billed_time_factor = time_factors[activity_id]
+            if billed_rate:
+                delta[1] += sign * hours * float(billed_time_factor) * float(billed_rate)
+        missing = []
+        for project_id, (hours, cost) in deltas.items():
+            if not ProjectBudgetSnapshot.objects.filter(project=project_id).update(
+                hours=models.F('hours') + hours, cost=models.F('cost') + cost, updated=timezone.now()):
+                    missing.append(project_id)
+        for snapshot in ProjectBudgetSnapshot.objects.filter(project__in=set(deltas) - set(missing)
+            ).select_related('project'):
+                snapshot.update_balance(snapshot.project.budget)
+                ProjectBudgetSnapshot.objects.filter(pk=snapshot.pk).update(balance=snapshot.balance, 
+                    coverage=snapshot.coverage)
+        ProjectBudgetSnapshot.refresh(missing)
+
+    @staticmethod
+    def refresh(projects=None):
+        """
+        Recomputes the snapshots of the given projects, or of all projects, in
+        a single aggregate query.
+        """
+        qs = Project._base_manager.all()
+        snapshots = ProjectBudgetSnapshot.objects.all()
+        if projects is not None:
+            project_ids = [getattr(project, 'pk', project) for project in projects]
+            if not project_ids:
+                return
+            qs = qs.filter(pk__in=project_ids)
+            snapshots = snapshots.filter(project__in=project_ids)
+        now = timezone.now()
+        created = []
+        for project in Project.annotate_totals(qs):
+            snapshot = ProjectBudgetSnapshot(project=project, hours=project.hours_sum or 0,
+                cost=float(project.cost_sum or 0), updated=now)
+            snapshot.update_balance(project.budget)
+            created.append(snapshot)
+        snapshots.delete()
+        ProjectBudgetSnapshot.objects.bulk_create(created)
+
+    @staticmethod
+    def mark_stale(**lookups):
+        """
+        Marks the snapshots of all projects with entries matching the lookups as 
+        stale, e.g. after a rate changed.
+        """
+        projects = Clock.objects.filter(**lookups).order_by().values('project').distinct()
+        ProjectBudgetSnapshot.objects.filter(project__in=projects).update(stale=True)
+
+
+@receiver(post_init, sender=Clock)
+def remember_clock_day(sender, instance, **kwargs):
+    # new entries aren't part of any daily totals until they are saved
+    instance._clock_day = ClockDay.get_state(instance) if instance.pk else None
+    instance._budget_state = ProjectBudgetSnapshot.get_state(instance)
+
+
+@receiver(post_save, sender=Clock)
+@receiver(post_delete, sender=Clock)
+def clock_saved_or_deleted(sender, instance, signal, **kwargs):
+    previous_state = getattr(instance, '_clock_day', None)
+    state = ClockDay.get_state(instance) if signal is post_save else None
+    # a new entry without hours, e.g. of clocking in, doesn't change the 
+    # credited hours; its day is recomputed once it is clocked out
+    totals_changed = state != previous_state and not (previous_state is None  \
+        and state is not None and state[4] is None)
+    dates_per_user = {}
+    for day_state in (previous_state, (instance.user_id, instance.start)):
+        if day_state and day_state[0] and day_state[1]:
+            dates_per_user.setdefault(day_state[0], set()).add(Clock.local_date(day_state[1]))
+    for user_id, dates in dates_per_user.items():
+        clock_entries_changed.send(sender=Clock, user_id=user_id, dates=dates, totals_changed=totals_changed)
+    instance._clock_day = state
+
+
+@receiver(post_save, sender=Clock)
+def clock_saved_update_budget_snapshot(sender, instance, created, **kwargs):
+    state = ProjectBudgetSnapshot.get_state(instance)
+    previous_state = getattr(instance, '_budget_state', None)
+    if created or previous_state is None:
+        ProjectBudgetSnapshot.apply_changes([], [state])
+    elif state != previous_state:
+        ProjectBudgetSnapshot.apply_changes([previous_state], [state])
+    instance._budget_state = state
+
+
+@receiver(post_delete, sender=Clock)
+def clock_deleted_update_budget_snapshot(sender, instance, **kwargs):
+    ProjectBudgetSnapshot.apply_changes([ProjectBudgetSnapshot.get_state(instance)], [])
+
+
+@receiver(clock_entries_changed)
+def refresh_clock_days(sender, user_id, dates, totals_changed=True, **kwargs):
+    if totals_changed:
+        ClockDay.refresh(user_id, dates)
+
+
+@receiver(clock_entries_changed)
+def forget_clocked_in_time(sender, user_id, **kwargs):
+    Clock.forget_clocked_in_time(user_id)
+
+
+@receiver(clock_entries_changed)
+def forget_live_baseline(sender, user_id, dates, **kwargs):
+    Clock.forget_live_baseline(user_id, dates)
+
+
+@receiver(clock_entries_changed)
+def forget_summaries_of_entries(sender, user_id, dates, **kwargs):
+    Clock.forget_summaries_of_entries(user_id, dates)
+
+
+@receiver(post_init, sender=Activity)
+def remember_time_factor(sender, instance, **kwargs):
+    instance._time_factor = instance.time_factor
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, created, **kwargs):
+    # only the time factor affects totals, budgets and summaries
+    if not created and instance.time_factor != getattr(instance, '_time_factor', None):
+        ClockDay.refresh_activity(instance)
+        ProjectBudgetSnapshot.mark_stale(activity=instance)
+        Clock.forget_summaries_of_options()
+    instance._time_factor = instance.time_factor
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    CurrentUserMiddleware.clear_request_cache()
+    try:
+        snapshot = ProjectBudgetSnapshot.objects.get(project=instance)
+    except ProjectBudgetSnapshot.DoesNotExist:
+        return
+    snapshot.update_balance(instance.budget)
+    ProjectBudgetSnapshot.objects.filter(pk=snapshot.pk).update(balance=snapshot.balance, coverage=snapshot.coverage)
+
+
+@receiver(post_save, sender=ActivityOptions)
+@receiver(post_delete, sender=ActivityOptions)
+def activity_options_saved_or_deleted(sender, instance, **kwargs):
+    CurrentUserMiddleware.clear_request_cache()
+    ClockDay.refresh_activity(instance.activity_id, user=instance.user_id)
+    if instance.user_id:
+        ProjectBudgetSnapshot.mark_stale(activity=instance.activity_id, user=instance.user_id)
+    else:
+        ProjectBudgetSnapshot.mark_stale(activity=instance.activity_id)
+    Clock.forget_summaries_of_options(instance.user_id)
+
+
+@receiver(post_save, sender=ClockOptions)
+@receiver(post_delete, sender=ClockOptions)
+def clock_options_saved_or_deleted(sender, instance, **kwargs):
+    CurrentUserMiddleware.clear_request_cache()
+    Clock.forget_summaries_of_options(instance.user_id)
+    if instance.user_id:
+        Clock.forget_live_baseline(instance.user_id, [datetime.date.today()])
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def holiday_saved_or_deleted(sender, instance, **kwargs):
+    # target hours depend on holidays; forgetting the summaries of the 
+    # default options forgets all summaries and live baselines
+    Clock.forget_summaries_of_options()
@@ -12,6 +12,22 @@ WORKING_DAYS_DEFAULT = (2, 3, 4, 5, 6) # 1=Sunday .. 7=Saturday
 HOURS_PER_WEEK_DEFAULT = 40
 DISPLAY_BALANCE_DEFAULT = True
 DISPLAY_CLOSING_DEFAULT = False
+CLOCK_RETRIES = 3 # retries of clocking in when a concurrent request clocked in
+# number of clock entries the change list counts at most
+CHANGELIST_COUNT_LIMIT = getattr(settings, 'TIME_TRACKING_CHANGELIST_COUNT_LIMIT', 10000)
+# seconds between polls of the live status
+LIVE_STATUS_POLL_INTERVAL = getattr(settings, 'TIME_TRACKING_LIVE_STATUS_POLL_INTERVAL', 30)
+# whether the live status is streamed as server-sent events, which occupy a 
+# worker per stream, so only for asynchronous or threaded servers
+LIVE_STATUS_STREAM = getattr(settings, 'TIME_TRACKING_LIVE_STATUS_STREAM', False)
+# seconds between live status events, and seconds until clients reconnect
+LIVE_STATUS_INTERVAL = getattr(settings, 'TIME_TRACKING_LIVE_STATUS_INTERVAL', 10)
+LIVE_STATUS_DURATION = getattr(settings, 'TIME_TRACKING_LIVE_STATUS_DURATION', 60)
+LIVE_BASELINE_TIMEOUT = 3600 # seconds until changed default clock options apply to live status
+SUMMARY_CACHE_SIZE = getattr(settings, 'TIME_TRACKING_SUMMARY_CACHE_SIZE', 500) # summaries cached in-process
+SUMMARY_CACHE_TIMEOUT = 86400 # seconds summaries and their versions are cached
+SUMMARY_VERSION_LOCAL_TIMEOUT = 60 # seconds versions are cached if the cache isn't shared by processes
+SUMMARY_CACHE_MAX_MONTHS = 24 # longer summaries are invalidated by changes of any entry
 
 DATE_FORMAT = getattr(settings, 'TIME_TRACKING_DATE_FORMAT', None) or get_format('DATE_FORMAT')
 TIME_FORMAT = getattr(settings, 'TIME_TRACKING_TIME_FORMAT', None) or get_format('TIME_FORMAT')
\ No newline at end of file
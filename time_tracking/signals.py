@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent with the dates (in the default time zone) on which clock entries of a
+# user were created, changed or deleted. Code that changes entries without 
+# calling Clock.save() or Clock.delete(), e.g. QuerySet.update(), needs to
+# send it as well. `totals_changed` is False if the daily totals of the dates
+# don't change, e.g. when a user clocks in, so that they aren't recomputed.
+clock_entries_changed = Signal(providing_args=['user_id', 'dates', 'totals_changed'])
@@ -0,0 +1,3 @@
+-- Partial unique index ensuring that a user is clocked in with one entry at 
+-- most, which is also used for looking up that entry
+CREATE UNIQUE INDEX time_tracking_clock_running ON time_tracking_clock (user_id) WHERE "end" IS NULL;
@@ -0,0 +1,169 @@
+# coding=utf-8
+from time_tracking.cache import get_cache, get_summary_cache
+from time_tracking.middleware import acting_as
+from time_tracking.models import Clock, Project, Activity
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, connections, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from multiprocessing.pool import ThreadPool
+import datetime
+import random
+
+PASSWORD = 'test'
+
+
+class ConcurrentClockInTest(TransactionTestCase):
+    """
+    Clocks users in, out and into other projects from concurrent threads,
+    which needs a test database that isn't an in-memory SQLite database, e.g.
+    one with TEST_NAME set. Clocking in while a concurrent request clocked in
+    is simulated on any database.
+    """
+    THREADS = 8
+    ITERATIONS = 20
+
+    def setUp(self):
+        get_cache().clear()
+        Activity.objects.create(name='work', activity_type=Activity.WORK, time_factor=1)
+        self.users = [User.objects.create(username='user-%i' % i) for i in range(2)]
+        self.projects = [Project.objects.create(name='project-%i' % i) for i in range(2)]
+
+    def test_clocked_in_once(self):
+        if connection.settings_dict['NAME'] == ':memory:':
+            self.skipTest('Threads use in-memory SQLite databases of their own.')
+
+        def work(index):
+            rand = random.Random(index)
+            actions = 0
+            try:
+                for i in range(self.ITERATIONS):
+                    user = rand.choice(self.users)
+                    action = rand.choice(('in', 'switch', 'out'))
+                    try:
+                        with acting_as(user):
+                            if action == 'out':
+                                Clock.clock_out_user(user)
+                            else:
+                                Clock.clock_in(user, rand.choice(self.projects + [None]), switch=(action == 'switch'))
+                    except DatabaseError, e:
+                        # SQLite locks the whole database while writing; any 
+                        # other error, e.g. an IntegrityError that clock_in()
+                        # didn't retry, fails the test
+                        if 'database is locked' not in str(e):
+                            raise
+                    else:
+                        actions += 1
+            finally:
+                connections[DEFAULT_DB_ALIAS].close()
+            return actions
+
+        pool = ThreadPool(self.THREADS)
+        try:
+            actions = pool.map(work, range(self.THREADS))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertTrue(all(actions), actions)
+        open_entries = Clock.objects.filter(end__isnull=True).values('user').annotate(count=Count('pk'))
+        self.assertTrue(all(entry['count'] <= 1 for entry in open_entries), open_entries)
+
+    def test_retried_after_concurrent_clock_in(self):
+        user = self.users[0]
+        with acting_as(user):
+            clocked_in_time = Clock.clock_in(user)[0]
+        get_clocked_in_time = Clock._get_clocked_in_time
+        calls = []
+
+        def get_stale_clocked_in_time(user_id):
+            # the first attempt doesn't see the entry, as if it had been 
+            # created by a concurrent request after the row of the user was read
+            calls.append(user_id)
+            return None if len(calls) == 1 else get_clocked_in_time(user_id)
+
+        Clock._get_clocked_in_time = staticmethod(get_stale_clocked_in_time)
+        try:
+            with acting_as(user):
+                clock_in_time, clocked_out_time = Clock.clock_in(user, self.projects[0], switch=True)
+        finally:
+            Clock._get_clocked_in_time = staticmethod(get_clocked_in_time)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(clocked_out_time, clocked_in_time)
+        self.assertEqual(list(Clock.objects.filter(end__isnull=True)), [clock_in_time])
+
+
+class ClockChangeListTest(TestCase):
+
+    def setUp(self):
+        activities = [Activity.objects.create(name='activity-%i' % i, activity_type=Activity.WORK,
+            time_factor=1) for i in range(3)]
+        users = [User.objects.create(username='user-%i' % i) for i in range(3)]
+        projects = [Project.objects.create(name='project-%i' % i) for i in range(5)]
+        self.user = User(username='admin', is_staff=True, is_superuser=True)
+        self.user.set_password(PASSWORD)
+        self.user.save()
+        start = timezone.now() - datetime.timedelta(days=60)
+        for i in range(60):
+            Clock(user=users[i % 3], activity=activities[i % 2], project=projects[i % 5],
+                start=start + datetime.timedelta(days=i), end=start + datetime.timedelta(days=i, hours=2)).save()
+        self.client.login(username='admin', password=PASSWORD)
+
+    def get_change_list(self, list_per_page):
+        # each page summarizes the entries again
+        get_cache().clear()
+        get_summary_cache().clear()
+        # reversing loads the URLconf, which registers the model admins
+        url = reverse('admin:time_tracking_clock_changelist')
+        model_admin = site._registry[Clock]
+        default_list_per_page = model_admin.list_per_page
+        model_admin.list_per_page = list_per_page
+        try:
+            response = self.client.get(url)
+        finally:
+            model_admin.list_per_page = default_list_per_page
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), list_per_page)
+        return response
+
+    def test_queries_independent_of_page_size(self):
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            queries = len(connection.queries)
+            self.get_change_list(5)
+            queries = len(connection.queries) - queries
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        with self.assertNumQueries(queries):
+            self.get_change_list(50)
+
+
+@override_settings(TIME_ZONE='Europe/Zurich')
+class ClockSummaryTest(TestCase):
+
+    def setUp(self):
+        Activity.objects.create(name='work', activity_type=Activity.WORK, time_factor=1)
+        self.user = User.objects.create(username='user')
+        tz = timezone.get_default_timezone()
+        day = datetime.date.today() - datetime.timedelta(days=10)
+        # the second entry starts on the previous day in UTC
+        for start in (datetime.datetime.combine(day, datetime.time(10)), 
+            datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0, 30))):
+                start = timezone.make_aware(start, tz)
+                with acting_as(self.user):
+                    Clock(user=self.user, start=start, end=start + datetime.timedelta(hours=2)).save()
+
+    def test_days_counted_in_default_time_zone(self):
+        entries = Clock.objects.filter(user=self.user)
+        with acting_as(self.user):
+            summary = Clock._summarize(self.user, entries)
+            rollup_summary = Clock._summarize(self.user, entries, {'user': self.user})
+        self.assertEqual(summary['days']['actual'], 2)
+        self.assertEqual(rollup_summary['days']['actual'], 2)
+        self.assertEqual(summary['hours']['actual'], rollup_summary['hours']['actual'])
@@ -0,0 +1,9 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('time_tracking.views',
+    url(r'^clock/$', 'clock_status', name='time_tracking_api_clock_status'),
+    url(r'^clock/in/$', 'clock_in', name='time_tracking_api_clock_in'),
+    url(r'^clock/out/$', 'clock_out', name='time_tracking_api_clock_out'),
+    url(r'^clock/switch/$', 'clock_switch', name='time_tracking_api_clock_switch'),
+    url(r'^clock/live/$', 'clock_live', name='time_tracking_api_clock_live'),
+)
@@ -0,0 +1,206 @@
+"""
+Minimal JSON endpoints for clocking in and out, for terminals and mobile
+clients that don't need the admin. Each request runs in a single transaction 
+that locks the row of the user (see Clock.run_clocked()), so that concurrent
+requests of the same user are serialized, and returns the resulting entry.
+The live status of the user can be polled or streamed as server-sent events.
+"""
+from time_tracking.instrumentation import instrumented
+from time_tracking.middleware import acting_as
+from time_tracking.models import Clock, Project
+from time_tracking.settings import LIVE_STATUS_STREAM, LIVE_STATUS_INTERVAL, LIVE_STATUS_DURATION
+from time_tracking.templatetags import clockformats
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.defaultfilters import time as format_time
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+from django.views.decorators.cache import never_cache
+from functools import wraps
+import json
+import time
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type='application/json', status=status)
+
+
+def error_response(message, status):
+    return json_response({'error': message}, status=status)
+
+
+def entry_data(entry):
+    if entry is None:
+        return None
+    related = lambda obj: obj and {'id': obj.pk, 'name': obj.__unicode__()}
+    return {
+        'id': entry.pk,
+        'user': entry.user_id,
+        'start': entry.start.isoformat(),
+        'end': entry.end and entry.end.isoformat(),
+        'hours': entry.hours,
+        'project': related(entry.project),
+        'activity': related(entry.activity),
+    }
+
+
+def entry_response(entry, status=200, **extra):
+    data = {'clocked_in': bool(entry and not entry.end), 'entry': entry_data(entry)}
+    data.update(extra)
+    return json_response(data, status=status)
+
+
+def api_view(methods, perm=None):
+    """
+    Returns a decorator that restricts a view to the given HTTP methods and to
+    authenticated users with the given permission, and responds with JSON 
+    errors otherwise.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                response = error_response(_('Method not allowed.'), 405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            if not request.user.is_authenticated():
+                return error_response(_('Authentication required.'), 401)
+            if perm and not request.user.has_perm(perm):
+                return error_response(_('Permission denied.'), 403)
+            return view(request, *args, **kwargs)
+        return never_cache(wrapped)
+    return decorator
+
+
+def get_project(request):
+    """
+    Returns the project given by the `project` parameter, which must be one
+    of the projects the user may clock into, or None if no project is given.
+    Raises Project.DoesNotExist for unknown projects.
+    """
+    pk = request.POST.get('project')
+    if not pk:
+        return None
+    try:
+        return Project.get_queryset_for_current_user().get(pk=int(pk))
+    except ValueError:
+        raise Project.DoesNotExist
+
+
+@api_view(['GET'])
+def clock_status(request):
+    """Returns the entry the user is currently clocked in with."""
+    return entry_response(Clock.clocked_in_time(request.user))
+
+
+@api_view(['POST'], 'time_tracking.add_clock')
+@instrumented('api_clock_in')
+def clock_in(request):
+    """Clocks the user in, optionally into the project given by `project`."""
+    try:
+        project = get_project(request)
+    except Project.DoesNotExist:
+        return error_response(_('Invalid project.'), 400)
+    clock_in_time, clocked_out_time = Clock.clock_in(request.user, project)
+    if not clock_in_time:
+        return entry_response(Clock.clocked_in_time(request.user), 409, error=_('Please clock out first.'))
+    return entry_response(clock_in_time, 201)
+
+
+@api_view(['POST'], 'time_tracking.change_clock')
+@instrumented('api_clock_out')
+def clock_out(request):
+    """Clocks the user out and returns the closed entry."""
+    clocked_out_time = Clock.clock_out_user(request.user)
+    if not clocked_out_time:
+        return entry_response(None, 409, error=_('Please clock in first.'))
+    return entry_response(clocked_out_time)
+
+
+@api_view(['POST'], 'time_tracking.add_clock')
+@instrumented('api_clock_switch')
+def clock_switch(request):
+    """
+    Clocks the user out of the current entry, if any, and into the project 
+    given by `project`. Returns the new entry and the closed one as `closed`.
+    """
+    try:
+        project = get_project(request)
+    except Project.DoesNotExist:
+        return error_response(_('Invalid project.'), 400)
+    clock_in_time, clocked_out_time = Clock.clock_in(request.user, project, switch=True)
+    if not clock_in_time:
+        return entry_response(Clock.clocked_in_time(request.user), closed=None)
+    return entry_response(clock_in_time, 201, closed=entry_data(clocked_out_time))
+
+
+def live_status_data(user, signature=None):
+    """
+    Returns the live status of the user, and the totals of the summary with 
+    the given filter signature (see Clock.live_summary()) as `summary` if 
+    passed, formatted like the time summary of the clock change list.
+    """
+    with acting_as(user):
+        status = Clock.live_status(user)
+        summary = signature and Clock.live_summary(user, signature)
+    clocked_in_time = status['clocked_in_time']
+    hours = status['hours']
+    closing = hours['closing'] and timezone.localtime(hours['closing'])
+    data = {
+        'clocked_in': clocked_in_time is not None,
+        'start': clocked_in_time and clocked_in_time.start.isoformat(),
+        'hours': {
+            'counting': hours['counting'],
+            'today': hours['today'],
+            'break_today': hours['break_today'],
+        },
+        'closing': closing and closing.isoformat(),
+        'formatted': {
+            'counting': clockformats.hours(hours['counting']),
+            'today': clockformats.hours(hours['today']),
+            'closing': closing and format_time(closing, 'TIME_FORMAT'),
+        },
+        'summary': None,
+    }
+    if summary:
+        data['summary'] = {
+            'actual': clockformats.hours(summary['actual']),
+            'today': clockformats.hours(summary['today']),
+            'balance': clockformats.hours(summary['balance'], signed=True),
+            'balance_until_weekend': clockformats.hours(summary['balance_until_weekend'], signed=True),
+            'closing': format_time(timezone.localtime(summary['closing']), 'TIME_FORMAT'),
+        }
+    return data
+
+
+def live_status_events(user, signature=None, interval=LIVE_STATUS_INTERVAL, duration=LIVE_STATUS_DURATION):
+    """
+    Yields server-sent events with the live status of the user every 
+    `interval` seconds, until `duration` seconds have passed.
+    """
+    started = time.time()
+    yield 'retry: %i\n\n' % (interval * 1000)
+    while True:
+        yield 'data: %s\n\n' % json.dumps(live_status_data(user, signature))
+        if time.time() + interval - started > duration:
+            break
+        time.sleep(interval)
+
+
+@api_view(['GET'])
+def clock_live(request):
+    """
+    Returns the entry the user is clocked in with, the hours since it started,
+    today's total and the projected closing time, computed from cached totals,
+    and the updated totals of the summary with the filter signature given by 
+    `summary`. If LIVE_STATUS_STREAM is set, clients accepting 
+    `text/event-stream` get them as server-sent events every 
+    LIVE_STATUS_INTERVAL seconds for LIVE_STATUS_DURATION seconds, after which
+    EventSource reconnects, and all others once as JSON.
+    """
+    signature = request.GET.get('summary')
+    if not LIVE_STATUS_STREAM or 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+        return json_response(live_status_data(request.user, signature))
+    response = StreamingHttpResponse(live_status_events(request.user, signature), content_type='text/event-stream')
+    # don't let proxies buffer the events
+    response['X-Accel-Buffering'] = 'no'
+    return response